@@ -0,0 +1,89 @@
+"""End-to-end latency of ``Figure.save`` and checks of the compile paths (skipped without ``latexmk``)."""
+import pytest
+
+import tikzplot
+
+pytestmark = pytest.mark.latex
+
+
+def build(title=None):
+    figure = tikzplot.Figure()
+    axis = figure.axis(xlabel='x', ylabel='y', title=title)
+    x = [0.01 * i for i in range(1000)]
+    axis.plot(x, [xi ** 2 for xi in x], legendentry='square')
+    return figure
+
+
+def is_pdf(path):
+    with open(path, 'rb') as f:
+        return f.read(5) == b'%PDF-'
+
+
+def save(figure, filename, *args):
+    figure.save(filename, *args)
+    assert is_pdf(filename)
+
+
+def test_save(benchmark, tmp_path):
+    figure = build()
+    benchmark.pedantic(save, args=(figure, tmp_path / 'figure.pdf'), rounds=3)
+
+
+def test_save_precompiled(benchmark, tmp_path):
+    figure = build()
+    figure.precompile = True
+    save(figure, tmp_path / 'figure.pdf', 'pdflatex')  # build the format
+    benchmark.pedantic(save, args=(figure, tmp_path / 'figure.pdf', 'pdflatex'), rounds=3)
+
+
+def test_save_cached(benchmark, tmp_path):
+    figure = build()
+    figure.cache = tikzplot.CompileCache(tmp_path / 'cache')
+    save(figure, tmp_path / 'figure.pdf')
+    benchmark(save, figure, tmp_path / 'figure.pdf')
+
+
+def test_worker_round_trip(tmp_path):
+    with tikzplot.CompileWorker() as worker:
+        assert worker.client().ping()
+        figure = build()
+        assert tikzplot.Figure.worker is not None
+        save(figure, tmp_path / 'figure.pdf')
+        filenames = [tmp_path / 'figure{}.pdf'.format(i) for i in range(3)]
+        assert tikzplot.save_all([build(str(i)) for i in range(3)], filenames) == [None] * 3
+        assert all(map(is_pdf, filenames))
+    assert tikzplot.Figure.worker is None
+
+
+def test_worker_rerun_for_references(tmp_path):
+    figure = tikzplot.Figure()
+    figure.axis(title=r'see \ref{later}').plot([0, 1], [0, 1])
+    figure.axis(title=r'\label{later}', yshift='-6cm').plot([0, 1], [1, 0])
+    figure.save_tikz(tmp_path / 'figure.tikz')
+    with tikzplot.CompileWorker() as worker:
+        success, pdf, log = worker.client().compile(tmp_path / 'figure.tikz')
+    assert success and pdf.startswith(b'%PDF-')
+    assert 'There were undefined references' not in log
+
+
+def test_save_batch(tmp_path):
+    filenames = [tmp_path / 'figure{}.pdf'.format(i) for i in range(3)]
+    tikzplot.save_batch([build(str(i)) for i in range(3)], filenames)
+    assert all(map(is_pdf, filenames))
+
+
+def test_save_batch_externalized(tmp_path):
+    external = tmp_path / 'external'
+    filenames = [tmp_path / 'figure{}.pdf'.format(i) for i in range(3)]
+    tikzplot.save_batch([build(str(i)) for i in range(3)], filenames, externalize=True, external_dir=external)
+    assert all(map(is_pdf, filenames))
+    pictures = sorted(external.glob('*.pdf'))
+    assert len(pictures) == 3
+    compiled = [p.stat().st_mtime_ns for p in pictures]
+
+    # only the changed figure is compiled again
+    tikzplot.save_batch([build('0'), build('changed'), build('2')], filenames, externalize=True,
+                        external_dir=external)
+    assert all(map(is_pdf, filenames))
+    recompiled = [p.stat().st_mtime_ns != t for p, t in zip(pictures, compiled)]
+    assert recompiled == [False, True, False]
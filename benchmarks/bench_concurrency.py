@@ -0,0 +1,104 @@
+"""Build and write figures from a thread pool and check that the output matches sequential writes."""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import tikzplot
+
+FIGURES = 64
+THREADS = 8
+
+
+def build(i):
+    rng = np.random.default_rng(i)
+    x = np.sort(rng.random(200))
+    y = np.cumsum(rng.normal(size=200))
+    figure = tikzplot.Figure()
+    ax = figure.axis(title='figure {}'.format(i))
+    ax.plot(x, y, 'thick', legendentry='line')
+    ax.errorplot(x, y, np.full((200, 2), 0.5), legendentry='error')
+    ax.violin(rng.normal(size=500), location=2)
+    ax.imshow(rng.random((20, 30)))
+    group = figure.subplot(rows=1, cols=2, xlabel='x', ylabel='y')
+    group.nextaxis().plot(x, y)
+    group.nextaxis().plot(y, x)
+    return figure
+
+
+def text(figure):
+    buffer = io.StringIO()
+    figure.write(buffer)
+    return buffer.getvalue()
+
+
+def build_and_write(i):
+    return text(build(i))
+
+
+def test_build_and_write():
+    expected = [build_and_write(i) for i in range(FIGURES)]
+    with ThreadPoolExecutor(THREADS) as pool:
+        assert list(pool.map(build_and_write, range(FIGURES))) == expected
+
+
+def test_write_shared_figure():
+    figure = build(0)
+    expected = text(figure)
+    with ThreadPoolExecutor(THREADS) as pool:
+        assert set(pool.map(text, [figure] * FIGURES)) == {expected}
+    assert text(figure) == expected
+
+
+def test_write_mpl_contents(tmp_path):
+    pytest.importorskip('matplotlib')
+    import matplotlib.figure
+    mpl_figure = matplotlib.figure.Figure()
+    mpl_axis = mpl_figure.add_subplot()
+    mpl_axis.plot([0, 1, 2], [1, 0, 1])
+    figure = tikzplot.Figure()
+    contents = tikzplot.MPLAxisContents(mpl_axis)
+    figure.axis().children.append(contents)
+
+    def save(i):
+        filename = tmp_path / 'figure{}.tikz'.format(i)
+        figure.save_tikz(filename)
+        return filename.read_text().replace(filename.stem, 'figure')
+
+    expected = save('')
+    with ThreadPoolExecutor(THREADS) as pool:
+        assert set(pool.map(save, range(FIGURES))) == {expected}
+    assert mpl_axis.axison
+    assert not contents.options and contents.filename is None
+
+
+def test_save_tikz_external(tmp_path):
+    def save(prefix, i):
+        figure = build(i)
+        figure.external_data = True
+        stem = '{}{}'.format(prefix, i)
+        figure.save_tikz(tmp_path / (stem + '.tikz'))
+        return {p.name[len(stem):]: p.read_text().replace(stem, 'figure') for p in tmp_path.glob(stem + '[._]*')}
+
+    expected = [save('sequential', i) for i in range(FIGURES)]
+    with ThreadPoolExecutor(THREADS) as pool:
+        assert list(pool.map(save, ['threaded'] * FIGURES, range(FIGURES))) == expected
+
+
+def test_unique_indices():
+    with ThreadPoolExecutor(THREADS) as pool:
+        indices = list(pool.map(lambda _: tikzplot.Figure().index, range(10 * FIGURES)))
+    assert len(set(indices)) == len(indices)
+
+
+@pytest.mark.parametrize('threads', [1, THREADS])
+def test_threaded_throughput(benchmark, threads):
+    benchmark.group = 'concurrency'
+
+    def generate():
+        with ThreadPoolExecutor(threads) as pool:
+            return list(pool.map(build_and_write, range(FIGURES)))
+
+    benchmark.pedantic(generate, rounds=3)
@@ -0,0 +1,61 @@
+"""Compare the bulk coordinate serializer against the per-point ``Coordinate.write`` path."""
+import io
+import random
+
+import pytest
+
+import tikzplot
+
+SIZES = [10**3, 10**4, 10**5]
+
+
+def make_coordinates(n, error=False):
+    rng = random.Random(n)
+    x = [rng.random() for _ in range(n)]
+    y = [rng.gauss(0, 1) for _ in range(n)]
+    e = [rng.random() for _ in range(n)] if error else None
+    return tikzplot.Coordinates.from_columns(x, y, error=e)
+
+
+def write_per_point(coordinates):
+    file = io.StringIO()
+    file.write("%\n")
+    file.write("coordinates {\n")
+    for coordinate in coordinates:
+        coordinate.write(file)
+    file.write('};\n')
+    return file.getvalue()
+
+
+def write_bulk(coordinates):
+    file = io.StringIO()
+    coordinates.write(file)
+    return file.getvalue()
+
+
+@pytest.mark.parametrize('error', [False, True])
+def test_bulk_output_matches_per_point(error):
+    coordinates = make_coordinates(1000, error)
+    assert write_bulk(coordinates) == write_per_point(coordinates)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_per_point(benchmark, n):
+    coordinates = make_coordinates(n)
+    benchmark.group = 'coordinates-{}'.format(n)
+    benchmark(write_per_point, coordinates)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_bulk(benchmark, n):
+    coordinates = make_coordinates(n)
+    benchmark.group = 'coordinates-{}'.format(n)
+    benchmark(write_bulk, coordinates)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_bulk_precision(benchmark, n):
+    coordinates = make_coordinates(n)
+    coordinates.precision = 6
+    benchmark.group = 'coordinates-{}'.format(n)
+    benchmark(write_bulk, coordinates)
@@ -0,0 +1,126 @@
+"""Figure construction and ``save_tikz`` throughput for line plots, matrix plots and group plots."""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import tikzplot
+
+large = pytest.mark.large
+SIZES = [10**3, 10**4, 10**5, pytest.param(10**6, marks=large), pytest.param(10**7, marks=large)]
+
+
+def sample(n):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.random(n))
+    return x, np.cumsum(rng.normal(size=n))
+
+
+def run(benchmark, function, *args, n=0):
+    """Benchmark ``function``, using few rounds for large inputs"""
+    if n >= 10**6:
+        return benchmark.pedantic(function, args=args, rounds=3)
+    return benchmark(function, *args)
+
+
+def build_plot(x, y):
+    figure = tikzplot.Figure()
+    figure.axis().plot(x, y)
+    return figure
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_build(benchmark, n):
+    x, y = sample(n)
+    benchmark.group = 'build'
+    run(benchmark, build_plot, x, y, n=n)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_save_tikz(benchmark, memory, tmp_path, n):
+    figure = build_plot(*sample(n))
+    filename = tmp_path / 'figure.tikz'
+    benchmark.group = 'save_tikz'
+    run(benchmark, figure.save_tikz, filename, n=n)
+    memory(figure.save_tikz, filename)
+    benchmark.extra_info['bytes'] = filename.stat().st_size
+
+
+@pytest.mark.parametrize('n', [10**3, 10**5])
+def test_save_tikz_external(benchmark, memory, tmp_path, n):
+    figure = build_plot(*sample(n))
+    figure.external_data = True
+    filename = tmp_path / 'figure.tikz'
+    benchmark.group = 'save_tikz'
+    run(benchmark, figure.save_tikz, filename, n=n)
+    memory(figure.save_tikz, filename)
+
+
+def save_imshow(matrix, filename, raster=None):
+    figure = tikzplot.Figure()
+    figure.axis().imshow(matrix, raster=raster)
+    figure.save_tikz(filename)
+
+
+@pytest.mark.parametrize('size', [30, 100, 300, pytest.param(1000, marks=large)])
+def test_imshow(benchmark, memory, tmp_path, size):
+    matrix = np.random.default_rng(size).random((size, size))
+    benchmark.group = 'imshow'
+    run(benchmark, save_imshow, matrix, tmp_path / 'figure.tikz', False, n=size**2)
+    memory(save_imshow, matrix, tmp_path / 'figure.tikz', False)
+
+
+@pytest.mark.parametrize('size', [1000, pytest.param(4000, marks=large)])
+def test_imshow_raster(benchmark, memory, tmp_path, size):
+    pytest.importorskip('matplotlib')
+    matrix = np.random.default_rng(size).random((size, size))
+    benchmark.group = 'imshow'
+    run(benchmark, save_imshow, matrix, tmp_path / 'figure.tikz', True, n=size**2)
+    memory(save_imshow, matrix, tmp_path / 'figure.tikz', True)
+
+
+def save_groupplot(panels, x, y, filename):
+    figure = tikzplot.Figure()
+    group = figure.subplot(rows=panels, cols=panels, xlabel='x', ylabel='y')
+    for _ in range(panels * panels):
+        group.nextaxis().plot(x, y)
+    figure.save_tikz(filename)
+
+
+@pytest.mark.parametrize('panels', [2, 4, 8, 16])
+def test_groupplot(benchmark, memory, tmp_path, panels):
+    x, y = sample(1000)
+    benchmark.group = 'groupplot'
+    run(benchmark, save_groupplot, panels, x, y, tmp_path / 'figure.tikz')
+    memory(save_groupplot, panels, x, y, tmp_path / 'figure.tikz')
+
+
+def mpl_figure(axes, n):
+    import matplotlib.figure
+    figure = tikzplot.Figure()
+    for i in range(axes):
+        mpl_axis = matplotlib.figure.Figure().add_subplot()
+        mpl_axis.plot(*sample(n))
+        figure.axis().mpl_contents(mpl_axis)
+    return figure
+
+
+def save_uncached(figure, filename):
+    tikzplot.clear_raster_cache()
+    figure.save_tikz(filename)
+
+
+@pytest.mark.parametrize('workers', [1, None])
+def test_mpl_contents(benchmark, tmp_path, workers):
+    pytest.importorskip('matplotlib')
+    figure = mpl_figure(4, 10**5)
+    figure.raster_workers = workers
+    benchmark.group = 'mpl_contents'
+    benchmark.pedantic(save_uncached, args=(figure, tmp_path / 'figure.tikz'), rounds=3)
+
+
+def test_mpl_contents_cached(benchmark, tmp_path):
+    pytest.importorskip('matplotlib')
+    figure = mpl_figure(4, 10**5)
+    figure.save_tikz(tmp_path / 'figure.tikz')
+    benchmark.group = 'mpl_contents'
+    run(benchmark, figure.save_tikz, tmp_path / 'figure.tikz')
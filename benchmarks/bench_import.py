@@ -0,0 +1,24 @@
+"""Import time of the tikzplot module (measured in a fresh interpreter)."""
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+def import_tikzplot(code='import tikzplot'):
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True)
+
+
+def test_heavy_modules_not_imported():
+    rv = import_tikzplot("import sys, tikzplot; print('sklearn' in sys.modules, 'pkg_resources' in sys.modules)")
+    assert rv.stdout.split() == ['False', 'False']
+
+
+def test_import_time(benchmark):
+    benchmark.pedantic(import_tikzplot, rounds=10, iterations=1)
+
+
+def test_python_startup(benchmark):
+    # reference for the interpreter start-up cost included in test_import_time
+    benchmark.pedantic(import_tikzplot, args=('pass',), rounds=10, iterations=1)
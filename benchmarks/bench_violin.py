@@ -0,0 +1,65 @@
+"""Compare the binned FFT kernel density estimate used by ``Axis.violin`` against scikit-learn."""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import tikzplot
+
+GRID = 100
+
+
+def sample(n):
+    rng = np.random.default_rng(n)
+    return np.concatenate((rng.normal(0, 1, n // 2), rng.normal(4, 0.5, n - n // 2)))
+
+
+def grid_for(data):
+    bandwidth = 1.06 * data.std(ddof=1) * len(data) ** (-1 / 5)
+    xmin = data.min() - 3 * bandwidth
+    xmax = data.max() + 3 * bandwidth
+    step = (xmax - xmin) / GRID
+    return xmin, step, bandwidth
+
+
+def native_kde(data):
+    xmin, step, bandwidth = grid_for(data)
+    return tikzplot._binned_gaussian_kde(data, xmin, step, GRID, bandwidth)
+
+
+def sklearn_kde(data):
+    from sklearn.neighbors import KernelDensity
+    xmin, step, bandwidth = grid_for(data)
+    x = xmin + np.arange(GRID) * step
+    kde = KernelDensity(bandwidth=bandwidth).fit(data.reshape(-1, 1))
+    return np.exp(kde.score_samples(x.reshape(-1, 1)))
+
+
+@pytest.mark.parametrize('n', [10**2, 10**3, 10**4])
+def test_accuracy(n):
+    pytest.importorskip('sklearn')
+    data = sample(n)
+    reference = sklearn_kde(data)
+    assert np.abs(native_kde(data) - reference).max() <= 1e-2 * reference.max()
+
+
+@pytest.mark.parametrize('n', [10**3, 10**4, 10**5, 10**6])
+def test_native(benchmark, n):
+    data = sample(n)
+    benchmark.group = 'kde-{}'.format(n)
+    benchmark(native_kde, data)
+
+
+@pytest.mark.parametrize('n', [10**3, 10**4, 10**5])
+def test_sklearn(benchmark, n):
+    pytest.importorskip('sklearn')
+    data = sample(n)
+    benchmark.group = 'kde-{}'.format(n)
+    benchmark.pedantic(sklearn_kde, args=(data,), rounds=3)
+
+
+@pytest.mark.parametrize('n', [10**3, 10**6])
+def test_violin(benchmark, memory, n):
+    data = sample(n)
+    benchmark.group = 'violin'
+    benchmark(lambda: tikzplot.Figure().axis().violin(data))
+    memory(lambda: tikzplot.Figure().axis().violin(data))
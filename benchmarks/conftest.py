@@ -0,0 +1,62 @@
+import shutil
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+
+# benchmark the working tree rather than an installed copy
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--large', action='store_true', help='include benchmarks with 10^6 and more points')
+
+
+def pytest_configure(config):
+    # store runs next to the benchmarks (where the baseline is kept) independent of the working directory
+    if config.getoption('benchmark_storage') == 'file://./.benchmarks':
+        config.option.benchmark_storage = 'file://' + str(BENCHMARK_DIR / '.benchmarks')
+    config.addinivalue_line('markers', 'large: slow benchmark, only run with --large')
+    config.addinivalue_line('markers', 'latex: needs latexmk and a LaTeX installation')
+
+
+def pytest_collection_modifyitems(config, items):
+    skip_large = pytest.mark.skip(reason='needs --large')
+    skip_latex = pytest.mark.skip(reason='latexmk not found')
+    has_latexmk = shutil.which('latexmk') is not None
+    for item in items:
+        if 'large' in item.keywords and not config.getoption('large'):
+            item.add_marker(skip_large)
+        if 'latex' in item.keywords and not has_latexmk:
+            item.add_marker(skip_latex)
+
+
+@pytest.fixture
+def memory(benchmark):
+    """Call ``memory(function, *args)`` to record the peak memory allocated by one call in the benchmark results"""
+    def measure(function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_mb'] = round(peak / 2**20, 3)
+        return peak
+    return measure
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    session = getattr(config, '_benchmarksession', None)
+    if session is None:
+        return
+    measured = [(bench.fullname, bench.extra_info['peak_memory_mb']) for bench in session.benchmarks
+                if 'peak_memory_mb' in bench.extra_info]
+    if measured:
+        terminalreporter.section('peak memory (MiB)')
+        width = max(len(name) for name, _ in measured)
+        for name, peak in measured:
+            terminalreporter.write_line('{:{}}  {:10.3f}'.format(name, width, peak))
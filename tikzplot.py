@@ -3,22 +3,72 @@ from collections import abc as _type
 from numbers import Number
 from pathlib import Path
 from subprocess import run as _run
+from subprocess import Popen as _Popen, PIPE as _PIPE, DEVNULL as _DEVNULL, TimeoutExpired as _TimeoutExpired
+from multiprocessing import get_context as _mp_context, get_all_start_methods as _start_methods
+from multiprocessing.connection import Listener as _Listener, Client as _Client
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool as _BrokenProcessPool
+from pickle import PicklingError as _PicklingError
 from shutil import copyfile as _copyfile
+from shutil import copyfileobj as _copyfileobj
+from shutil import rmtree as _rmtree
 from itertools import chain as _chain
 from itertools import repeat as _repeat
+from itertools import islice as _islice
+from itertools import count as _count
+from io import StringIO as _StringIO
+from io import BytesIO as _BytesIO
+from io import TextIOWrapper as _TextIOWrapper
+from contextlib import contextmanager as _contextmanager
+from functools import wraps as _wraps
+from time import perf_counter as _perf_counter
+from array import array as _array
 import tempfile
-from pkg_resources import get_distribution, DistributionNotFound
-from sklearn.neighbors import KernelDensity
-from statistics import stdev
+from getpass import getuser as _getuser
+import gzip
+import threading
+import weakref
+import atexit as _atexit
+import os
+import hashlib
+import re as _re
+try:
+    from importlib.metadata import version as _get_version, PackageNotFoundError
+except ImportError:  # Python < 3.8
+    from pkg_resources import DistributionNotFound as PackageNotFoundError
+    from pkg_resources import get_distribution
+
+    def _get_version(name):
+        return get_distribution(name).version
 from math import exp
 
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
 
 _ext_file_counter = _coll.Counter()
+_ext_file_lock = threading.Lock()
+_job_locks = {}  # locks of externalized jobs by path
+_job_locks_lock = threading.Lock()
+_buffer_size = 2**20  # buffer size used for writing output files
+_format_lock = threading.Lock()
+_mpl_lock = threading.Lock()  # serializes rendering with matplotlib
+_raster_cache = _coll.OrderedDict()  # rendered matplotlib axis contents by fingerprint, least recently used first
+_raster_cache_size = 64 * 2**20  # maximum total size of cached images in bytes
+_raster_pool = None  # (executor, pid, workers) used for rendering matplotlib axis contents in parallel
+_raster_pool_lock = threading.Lock()
+_raster_lock = threading.Lock()
+_option_versions = _count(1)
+_options_version = 0  # changes whenever an option list or value that has been written or copied is modified
+_pgfplots_colormaps = {'viridis': 'viridis', 'hot': 'hot2', 'jet': 'jet'}  # pgfplots names of matplotlib colormaps
 
 # define __version__
 try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
+    __version__ = _get_version(__name__)
+except PackageNotFoundError:
     # package is not installed
     pass
 
@@ -26,19 +76,431 @@ except DistributionNotFound:
 default_viewdir = Path(__file__).resolve().parent / 'tex'
 
 
-def clean_viewdir():
-    """Remove all temporal folders form default viewdir.
+def _user_id():
+    return os.getuid() if hasattr(os, 'getuid') else _getuser()
+
+
+default_workdir_root = Path(os.environ.get('TIKZPLOT_WORKDIR',
+                                           Path(tempfile.gettempdir()) / 'tikzplot-{}'.format(_user_id())))
+
+
+def _private_root(root):
+    """Create the directory ``root`` accessible only by the user (if needed) and return its resolved path
+
+    Raises :class:`PermissionError` if ``root`` belongs to another user.
+    """
+    root = Path(root).resolve()
+    root.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if hasattr(os, 'getuid') and root.stat().st_uid != os.getuid():
+        raise PermissionError("Working directory root {} belongs to another user".format(root))
+    return root
+
+
+class _WorkdirPool:
+    """Bounded pool of working directories shared by all figures
 
-    Note that this is not thread-safe and will delete files for currently open figures!
+    Directories are named ``wd-<pid>-*`` so that stale directories of dead processes can be
+    recognised. Released directories are emptied and kept for reuse up to ``max_free`` per root.
+    The lock only guards the bookkeeping, filesystem work happens outside of it. Idle directories
+    are removed at exit and directories released after ``close`` are removed rather than kept.
+    Externalized pictures of this process are kept in ``wd-<pid>-external``, which is removed at exit.
     """
-    for f in default_viewdir.iterdir():
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self._lock = threading.Lock()
+        self._free = _coll.defaultdict(list)
+        self._in_use = set()
+        self._external = set()
+        self._closed = False
+
+    def acquire(self, root):
+        root = _private_root(root)
+        with self._lock:
+            free = self._free[root]
+            path = free.pop() if free else None
+            if path is not None:
+                self._in_use.add(path)
+        if path is None:
+            path = Path(tempfile.mkdtemp(prefix='wd-{}-'.format(os.getpid()), dir=root))
+            with self._lock:
+                self._in_use.add(path)
+        return path
+
+    def release(self, path):
+        with self._lock:
+            self._in_use.discard(path)
+            keep = not self._closed and len(self._free[path.parent]) < self.max_free
+        if keep and path.is_dir():
+            _empty_dir(path)
+            with self._lock:
+                free = self._free[path.parent]
+                if not self._closed and len(free) < self.max_free:
+                    free.append(path)
+                    return
+        _rmtree(path, ignore_errors=True)
+
+    def clean(self, root):
+        """remove idle and stale directories below ``root``, never directories in use"""
+        root = Path(root).resolve()
+        with self._lock:
+            remove = self._free.pop(root, [])
+            in_use = set(self._in_use)
+        if root.is_dir():
+            for path in root.glob('wd-*-*'):
+                if path in in_use or not path.is_dir():
+                    continue
+                pid = path.name.split('-')[1]
+                if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                    remove.append(path)
+        for path in remove:
+            _rmtree(path, ignore_errors=True)
+
+    def external(self, root):
+        """directory for the externalized pictures of this process below ``root``"""
+        path = _private_root(root) / 'wd-{}-external'.format(os.getpid())
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._external.add(path)
+        return path
+
+    def close(self):
+        """remove all idle directories and stop keeping released ones"""
+        with self._lock:
+            self._closed = True
+            remove = [path for free in self._free.values() for path in free]
+            remove.extend(self._external)
+            self._free.clear()
+            self._external.clear()
+        for path in remove:
+            _rmtree(path, ignore_errors=True)
+
+
+def _empty_dir(path):
+    for f in path.iterdir():
         if f.is_dir():
-            for fi in f.iterdir():
-                fi.unlink()
-            f.rmdir()
+            _rmtree(f, ignore_errors=True)
+        else:
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_workdir_pool = _WorkdirPool()
+_atexit.register(_workdir_pool.close)
+_workdir_lock = threading.Lock()
+_figure_index_lock = threading.Lock()
 
 
-class BaseElement:
+def clean_viewdir(root=None):
+    """Remove idle working directories.
+
+    Cleans the pool below ``root`` (defaults to ``Figure.workdir_root``) including directories
+    left behind by dead processes, and temporary folders created by older versions in the default viewdir.
+    Directories of figures that are currently open are left alone, so this is safe to call at any time.
+    """
+    _workdir_pool.clean(root if root is not None else Figure.workdir_root)
+    for f in default_viewdir.glob('tmp*'):
+        if f.is_dir():
+            _rmtree(f, ignore_errors=True)
+
+
+def _ext_filename(file, suffix, register=True):
+    """Return the next free name for an external data file belonging to the output file"""
+    if hasattr(file, 'name'):
+        fname = Path(file.name).resolve()
+        with _ext_file_lock:
+            index = _ext_file_counter[fname]
+            _ext_file_counter[fname] += 1
+        filename = fname.with_name("{}_data{}{}".format(fname.stem, index, suffix))
+        if register:
+            _register_ext_file(file, filename)
+        return filename
+    else:
+        raise RuntimeError("Need explicit file name when writing to file-like object without name")
+
+
+def _register_ext_file(file, filename):
+    ext_files = getattr(file, 'ext_files', None)
+    if ext_files is not None:
+        ext_files.append(filename)
+
+
+_table_header = '# tikzplot data {}\n'  # first line of data tables, identifies the data by its hash
+_sidecar_suffixes = {'gzip': '.gz', 'npy': '.npz'}
+
+
+def _stored_table_key(path):
+    """Return the data hash stored in a table or sidecar file (``None`` if the file does not exist)"""
+    try:
+        if path.suffix == '.npz':
+            with _np.load(path) as stored:
+                return str(stored['key'])
+        with (gzip.open(path, 'rt') if path.suffix == '.gz' else open(path)) as f:
+            line = f.readline()
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None
+    prefix, _, suffix = _table_header.partition('{}')
+    if line.startswith(prefix) and line.endswith(suffix):
+        return line[len(prefix):-len(suffix)]
+    return None
+
+
+@_contextmanager
+def _gzip_text_writer(filename):
+    """Open a gzip-compressed text file for writing without timestamp or file name in the header, such that
+    identical data gives identical files"""
+    with open(filename, 'wb') as raw, gzip.GzipFile('', 'wb', 6, raw, mtime=0) as compressed:
+        with _TextIOWrapper(compressed) as f:
+            yield f
+
+
+def materialize_tables(tikzfile):
+    """Convert the compressed (``.dat.gz``) and binary (``.dat.npz``) data files of ``tikzfile`` to text tables.
+
+    Such files are written instead of text tables if the ``data_store`` of a :class:`Figure` is ``'gzip'`` or
+    ``'npy'``, and need to be converted before compiling the TikZ code. Tables that are up to date are not rewritten.
+    """
+    tikzfile = Path(tikzfile)
+    for path in sorted(tikzfile.parent.glob(tikzfile.stem + '_data*.dat.*')):
+        if path.suffix not in ('.gz', '.npz'):
+            continue
+        table = path.with_suffix('')
+        key = _stored_table_key(path)
+        if key is not None and key == _stored_table_key(table):
+            continue
+        if path.suffix == '.gz':
+            with gzip.open(path, 'rb') as source, open(table, 'wb') as target:
+                _copyfileobj(source, target, _buffer_size)
+        else:
+            with _np.load(path) as stored:
+                names = list(stored['names'])
+                data = Coordinates._from_table_columns({name: stored[name] for name in names})
+                data.write_table(table, str(stored['spec']) or None, key=key)
+
+
+def _build_format(latex, template, directory):
+    """Dump the preamble of ``template`` into a format file using ``mylatexformat`` and return the format name.
+
+    The format is only rebuilt if the template or the engine changed.
+    """
+    with open(template, 'rb') as f:
+        digest = hashlib.sha256(f.read() + latex.encode()).hexdigest()[:16]
+    name = '{}-{}-{}'.format(Path(template).stem, latex, digest)
+    directory = Path(directory)
+    with _format_lock:
+        if not (directory / (name + '.fmt')).exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=directory) as tmp:
+                rv = _run([latex, '-ini', '-interaction=nonstopmode', '-jobname={}'.format(name), '&{}'.format(latex),
+                           'mylatexformat.ltx', str(template)], cwd=tmp)
+                if rv.returncode != 0:
+                    with open(Path(tmp) / (name + '.log')) as f:
+                        raise CompileError("Building format {} failed".format(name), f.read())
+                os.replace(Path(tmp) / (name + '.fmt'), directory / (name + '.fmt'))
+    return name
+
+
+def _latexmk(latex, jobname, template, cwd, *options, precompile=False):
+    """Run latexmk on ``template`` (optionally using a precompiled format of its preamble, pdflatex only)"""
+    args = ['latexmk', "-{}".format(latex), *options, "-jobname={}".format(jobname)]
+    env = None
+    if precompile:
+        if latex != 'pdflatex':
+            # a dumped format does not keep the Lua state that LuaTeX packages (e.g. pgfplots) set up
+            raise ValueError("precompile is only supported with pdflatex, not {}".format(latex))
+        format_dir = _private_root(Figure.workdir_root) / 'formats'
+        fmt = _build_format(latex, template, format_dir)
+        args.append('-{0}={0} -fmt={1} %O %S'.format(latex, fmt))
+        env = dict(os.environ, TEXFORMATS=str(format_dir) + os.pathsep)
+    args.append(template)
+    return _run(args, cwd=cwd, env=env)
+
+
+_externalize_preamble = r"""\usepgfplotslibrary{{external}}
+\tikzset{{external/system call={{{latex} -halt-on-error -interaction=batchmode -jobname "\image"
+ "\string\def\string\tikzexternalrealjob{{\tikzexternalrealjob}}\string\input{{{template}}}"}}}}
+\tikzexternalize[prefix={prefix}/, mode=list and make]
+"""
+
+
+def _latexmk_externalized(latex, jobname, template, cwd, *options, precompile=False, externalize=False,
+                          max_workers=None, external_dir=None, timeout=600):
+    """Run latexmk, optionally externalizing each tikzpicture using the tikz ``external`` library.
+
+    Externalized pictures are stored in ``external_dir`` (defaults to a directory of this process below
+    ``Figure.workdir_root``) and only recompiled if their code changed. Pictures that need updating are compiled in
+    parallel with ``make -j max_workers`` (defaults to the number of CPUs). Runs with the same job name wait for each
+    other (up to ``timeout`` seconds), as they share the picture files.
+    """
+    materialize_tables(Path(cwd) / '{}.tikz'.format(jobname))
+    pre = Path(cwd) / '{}.pre'.format(jobname)
+    if not externalize:
+        if pre.exists():
+            pre.unlink()
+        return _latexmk(latex, jobname, template, cwd, *options, precompile=precompile)
+
+    if external_dir is None:
+        prefix = _workdir_pool.external(Figure.workdir_root)
+    else:
+        prefix = Path(external_dir).resolve()
+        prefix.mkdir(parents=True, exist_ok=True)
+    with open(pre, 'w') as f:
+        f.write(_externalize_preamble.format(latex=latex, template=Path(template).as_posix(),
+                                             prefix=prefix.as_posix()))
+    with _job_lock(prefix / jobname, timeout):
+        rv = _latexmk(latex, jobname, template, cwd, *options, precompile=precompile)
+        makefile = Path(cwd) / '{}.makefile'.format(jobname)
+        if rv.returncode == 0 and makefile.exists():
+            jobs = '-j{}'.format(max_workers or os.cpu_count() or 1)
+            rv = _run(['make', jobs, '-f', makefile.name], cwd=cwd)
+            if rv.returncode == 0:
+                # include the externalized pictures
+                rv = _latexmk(latex, jobname, template, cwd, '-g', *options, precompile=precompile)
+    return rv
+
+
+@_contextmanager
+def _job_lock(path, timeout):
+    """Hold the lock of this process for the job ``path``, raising :class:`TimeoutError` after ``timeout`` s"""
+    with _job_locks_lock:
+        lock = _job_locks.setdefault(path, threading.Lock())
+    if not lock.acquire(timeout=timeout):
+        raise TimeoutError("Timed out waiting for {}".format(path))
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+class _FigureWriter:
+    """Wraps the output file while writing a figure to make figure-wide settings available to its elements
+
+    If ``stats`` is set to a :class:`FigureStats` object, the bytes written are counted per type of the writing
+    element.
+    """
+    stats = None
+    _elements = None
+
+    def __init__(self, file, **settings):
+        self.file = file
+        self.ext_files = []  # external data files written alongside the output
+        self.__dict__.update(settings)
+        if self.stats is None:
+            self.write = file.write
+        else:
+            self._elements = []  # elements currently writing, innermost last (see _attributed)
+            self.write = self._counting_write
+        if hasattr(file, 'name'):
+            # restart numbering of external data files
+            with _ext_file_lock:
+                _ext_file_counter.pop(Path(file.name).resolve(), None)
+
+    def _counting_write(self, text):
+        name = type(self._elements[-1]).__name__ if self._elements else '(other)'
+        self.stats.bytes[name] += len(text.encode())
+        self.file.write(text)
+
+    def __getattr__(self, item):
+        return getattr(self.file, item)
+
+
+class FigureStats:
+    """Statistics collected while saving a figure (see :class:`Figure`)
+
+    ``times`` maps the phases ``'write'`` (generating the TikZ code), ``'cache'`` (cache lookup), ``'compile'`` (LaTeX)
+    and ``'copy'`` (copying the result) to their wall time in seconds. ``bytes`` counts the bytes of TikZ code by the
+    type of element that wrote them (excluding nested elements and external data files). ``tex_memory`` maps the
+    entries of the memory usage reported at the end of the LaTeX log to ``(used, available)`` (``None`` if no log was
+    read).
+    """
+    def __init__(self):
+        self.times = {}
+        self.bytes = _coll.Counter()
+        self.tex_memory = None
+
+    def __repr__(self):
+        return "{}(times={}, bytes={}, tex_memory={})".format(type(self).__name__, self.times, dict(self.bytes),
+                                                              self.tex_memory)
+
+    @_contextmanager
+    def phase(self, name):
+        """Context manager adding the time spent in the block to phase ``name``"""
+        start = _perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + _perf_counter() - start
+
+
+def _tex_memory(log):
+    """Parse the memory usage reported at the end of a LaTeX log"""
+    match = _re.search(r"Here is how much of \w+'s memory you used:\n((?: .*\n?)*)", log)
+    if match is None:
+        return None
+    usage = {}
+    for line in match.group(1).splitlines():
+        entry = _re.match(r'\s*(\S+) (.+?) out of (\S+)\s*$', line)
+        if entry is not None:
+            used, name, available = entry.groups()
+            usage[name] = (_int_or_str(used), _int_or_str(available))
+    return usage
+
+
+def _int_or_str(value):
+    return int(value) if value.isdigit() else value
+
+
+@_contextmanager
+def _phase(stats, name):
+    if stats is None:
+        yield
+    else:
+        with stats.phase(name):
+            yield
+
+
+def _attributed(write):
+    """Wrap a ``write`` method such that a counting :class:`_FigureWriter` attributes the output to the element"""
+    if getattr(write, '_attributed', False):
+        return write
+
+    @_wraps(write)
+    def attributed_write(self, file):
+        elements = file._elements if isinstance(file, _FigureWriter) else None
+        if elements is None:
+            return write(self, file)
+        elements.append(self)
+        try:
+            return write(self, file)
+        finally:
+            elements.pop()
+    attributed_write._attributed = True
+    return attributed_write
+
+
+class _AttributedWrites:
+    """Mixin wrapping the ``write`` methods of all subclasses with :func:`_attributed`"""
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'write' in vars(cls):
+            cls.write = _attributed(cls.write)
+
+
+class BaseElement(_AttributedWrites):
     def __init__(self):
         self.children = []
 
@@ -47,13 +509,42 @@ class BaseElement:
             child.write(file)
 
 
+def _iter_elements(element):
+    """Iterate over ``element`` and all its descendants"""
+    yield element
+    for child in getattr(element, 'children', ()):
+        yield from _iter_elements(child)
+
+
 class TikzElement(BaseElement):
     name = "element"
+    inherit = ()  # option lists (or elements, standing for their current options) merged in front of ``options``
 
     def __init__(self, *args, **kwargs):
         super().__init__()
         self.options = OptionList(*args, **kwargs)
 
+    def _derived(self, name, build, sources=()):
+        """Return the option list computed by ``build`` from the option lists ``sources``
+
+        ``build`` is only called again after options were modified or one of the ``sources`` was replaced.
+        """
+        cache = self.__dict__.get(name)
+        if (cache is None or cache[0] != _options_version or len(cache[1]) != len(sources)
+                or any(old is not new for old, new in zip(cache[1], sources))):
+            cache = self.__dict__[name] = (_options_version, sources, build())
+        return cache[2]
+
+    def _inherited(self):
+        return tuple(i.options if isinstance(i, TikzElement) else i for i in self.inherit)
+
+    def write_options(self, file):
+        if self.inherit:
+            sources = self._inherited() + (self.options,)
+            self._derived('_merged_options', lambda: OptionList(*sources), sources).write(file)
+        else:
+            self.options.write(file)
+
     def __contains__(self, item):
         return item in self.options
 
@@ -77,7 +568,7 @@ class TikzCommand(TikzElement):
     def write(self, file):
         file.write("%\n")
         file.write("\\{name}".format(name=self.name))
-        self.options.write(file)
+        self.write_options(file)
         super().write(file)
 
 
@@ -95,14 +586,31 @@ class TikzEnvironment(TikzElement):
     def write(self, file):
         file.write("%\n")
         file.write("\\begin{{{name}}}".format(name=self.name))
-        self.options.write(file)
+        self.write_options(file)
         file.write("%\n")
         super().write(file)
         file.write("%\n")
         file.write("\\end{{{name}}}\n".format(name=self.name))
 
 
-class BaseValue:
+def _options_changed():
+    global _options_version
+    _options_version = next(_option_versions)
+
+
+class BaseValue(_AttributedWrites):
+    _observed = False  # set once written or copied, after which modifications invalidate cached output
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self._observed:
+            _options_changed()
+
     def write(self, file):
         pass
 
@@ -116,6 +624,7 @@ class Value(BaseValue):
         return "{}({})".format(type(self).__name__,repr(self.value))
 
     def write(self, file):
+        self._observed = True
         if self.value is not None:
             file.write("{}".format(self.value))
 
@@ -132,6 +641,7 @@ class EncapsulatedValue(BaseValue):
         return "{}({})".format(type(self).__name__,repr(self.value))
 
     def write(self, file):
+        self._observed = True
         if self.value is not None:
             file.write('{')
             self.value.write(file)
@@ -149,35 +659,101 @@ class RGB(Value):
             raise ValueError('wrong number of arguments for color')
 
     def write(self, file):
+        self._observed = True
         if self.value is not None:
             file.write("{" + "rgb,1:red,{0};green,{1};blue,{2}".format(*self.value) + "}")
 
 
-class BaseList(_coll.OrderedDict):
+class BaseList(_AttributedWrites, _coll.OrderedDict):
+    """Ordered mapping of keys to tikz values
+
+    The serialized text is cached as long as all values are plain (numbers or strings, possibly nested in value
+    lists) and no option list or value that has been written or copied was modified in the meantime.
+    """
+    _observed = False  # set once written or copied, after which modifications invalidate cached output
+    _text = None  # (options version, serialized text or None if the values are not plain)
+
     def __init__(self, *args, **kwargs):
         super().__init__()
-        self.add(*args, **kwargs)
+        if args or kwargs:
+            self.add(*args, **kwargs)
+
+    def _changed(self):
+        if self._observed:
+            _options_changed()
 
     def __setitem__(self, key, value):
         super().__setitem__(key, as_tikz_value(value))
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self, last=True):
+        item = super().popitem(last)
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def move_to_end(self, key, last=True):
+        super().move_to_end(key, last)
+        self._changed()
 
     def add(self, *args, **kwargs):
         for arg in args:
-            if isinstance(arg, _type.Mapping):
+            if isinstance(arg, (str, Number)):
+                self[arg] = None
+            elif isinstance(arg, _type.Mapping):
+                if isinstance(arg, BaseList):
+                    arg._observed = True
                 for key, value in arg.items():
                     self[key] = value
             elif isinstance(arg, tuple) and len(arg) == 2:
                 self[arg[0]] = arg[1]
-            elif isinstance(arg, str) or isinstance(arg, Number):
-                self[arg] = None
             elif isinstance(arg, _type.Iterable):
                 for arg2 in arg:
                     self.add(arg2)
         for key, value in kwargs.items():
             self[key] = value
 
+    def _cached_text(self):
+        """Serialized items if all values are plain, else ``None``"""
+        self._observed = True
+        if self._text is None or self._text[0] != _options_version:
+            version = _options_version
+            if all(map(_is_plain_value, self.values())):
+                buffer = _StringIO()
+                self._write_items(buffer)
+                self._text = (version, buffer.getvalue())
+            else:
+                self._text = (version, None)
+        return self._text[1]
+
     def write(self, file):
+        text = self._cached_text()
+        if text is None:
+            self._write_items(file)
+        else:
+            file.write(text)
+
+    def _write_items(self, file):
         items = list(self.items())
+        if not items:
+            return
 
         def write_item(item):
             if item[1] is None:
@@ -192,6 +768,29 @@ class BaseList(_coll.OrderedDict):
         write_item(items[-1])
 
 
+def _is_plain_value(value):
+    if value is None:
+        return True
+    elif isinstance(value, BaseList):
+        return value._cached_text() is not None
+    elif isinstance(value, EncapsulatedValue):
+        return _is_plain_value(value.value)
+    elif isinstance(value, Value):
+        value._observed = True
+        return _is_plain_object(value.value)
+    else:
+        return False
+
+
+def _is_plain_object(obj):
+    if obj is None or isinstance(obj, (str, Number)):
+        return True
+    elif isinstance(obj, tuple):
+        return all(map(_is_plain_object, obj))
+    else:
+        return False
+
+
 class ValueList(BaseList, BaseValue):
 
     def write(self, file):
@@ -210,17 +809,388 @@ class OptionList(BaseList):
             file.write("]")
 
 
+class CompileError(RuntimeError):
+    """LaTeX failed to compile a figure (the contents of the log file are available as ``log``)"""
+    def __init__(self, message, log=None):
+        super().__init__(message)
+        self.log = log
+
+
+class CompileCache:
+    """Persistent cache of compiled figures.
+
+    Compiled PDFs are stored in ``directory`` (defaults to ``$XDG_CACHE_HOME/tikzplot``), keyed by a hash of the
+    generated TikZ code (including external data files and images), the LaTeX template and the engine name. If the
+    total size of the cache exceeds ``max_size`` bytes, the least recently used entries are removed. Graphics that are
+    not found relative to the current directory (e.g. on the TeX search path) only contribute their name to the key.
+    """
+    def __init__(self, directory=None, max_size=256 * 2**20):
+        if directory is None:
+            directory = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'tikzplot'
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(tikzfile, template, latex, ext_files=()):
+        h = hashlib.sha256()
+        for filename in (template, tikzfile, *ext_files):
+            key = _stored_table_key(Path(filename)) if Path(filename).suffix in ('.gz', '.npz') else None
+            if key is not None:
+                # compressed and binary files are identified by the hash of their data
+                data = key.encode()
+            else:
+                try:
+                    with open(filename, 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    # e.g. graphics found on the TeX search path
+                    data = 'missing {}'.format(filename).encode()
+            h.update(b'%d:' % len(data))
+            h.update(data)
+        h.update(latex.encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.directory / '{}.pdf'.format(key)
+
+    def get(self, key):
+        """Return the path of the cached PDF for ``key`` or ``None`` if it is not cached"""
+        path = self._path(key)
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, pdf):
+        """Add a compiled PDF to the cache"""
+        tmp = self.directory / '{}.{}.tmp'.format(key, os.getpid())
+        _copyfile(pdf, tmp)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self, max_size=None):
+        """Remove least recently used entries until the cache is at most ``max_size`` bytes"""
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        for path in self.directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        """Remove the entry for ``key`` from the cache (removes all entries if ``key`` is ``None``)"""
+        if key is None:
+            self.evict(max_size=0)
+        else:
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+
+class CompileWorker:
+    """Long-lived LaTeX compile server that keeps an engine with the preamble of the template loaded
+
+    The worker starts ``latex`` on ``template``, which loads the preamble and then waits for a job (the engine reads a
+    line from the terminal at ``\\endofdump``). A job copies the figure files into the directory of a waiting
+    engine and lets it continue, and a new engine is started right away, such that the start-up time of LaTeX is
+    hidden. Up to ``engines`` engines are kept waiting, and each connection is handled in its own thread, such that
+    several figures compile in parallel. Each engine compiles a single run of a single figure, so TeX errors do not
+    affect later jobs. While LaTeX asks for a rerun (e.g., for ``\\label``/``\\ref``), the figure is compiled again
+    with the ``.aux`` file of the previous run (up to ``max_runs`` runs).
+
+    Jobs are received over a local socket (or named pipe) at ``address`` using :mod:`multiprocessing.connection`.
+    ``start`` serves in a background thread and routes ``Figure.save`` (and ``save_all``) to the worker until
+    ``stop`` is called. To use a worker running in a different process, call ``serve_forever`` there and set
+    ``Figure.worker = WorkerClient(address, authkey, latex)``.
+    """
+    def __init__(self, latex='lualatex', template=None, address=None, authkey=None, timeout=300, engines=2,
+                 max_runs=3):
+        self.latex = latex
+        self.template = Path(template if template is not None else default_viewdir / 'viewtemplate.tex').resolve()
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.timeout = timeout
+        self.engines = engines
+        self.max_runs = max_runs
+        self.directory = Path(tempfile.mkdtemp(prefix='tikzplot-worker-'))
+        self._listener = _Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self._waiting = _coll.deque()  # started engines waiting for a job
+        self._engine_count = _count()
+        self._lock = threading.Lock()
+        self._handlers = set()
+        self._thread = None
+        self._client = None
+        self._stopping = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def client(self):
+        return WorkerClient(self.address, self.authkey, self.latex)
+
+    def start(self):
+        """Serve in a background thread and route compilation of figures to this worker"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        if Figure.worker is None:
+            self._client = Figure.worker = self.client()
+        return self
+
+    def stop(self):
+        if self._client is not None and Figure.worker is self._client:
+            Figure.worker = None
+        self._client = None
+        self._stopping = True
+        if self._thread is not None:
+            try:  # wake up the server thread
+                _Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+            self._thread.join()
+            self._thread = None
+        self._listener.close()
+        for handler in list(self._handlers):
+            handler.join()
+        with self._lock:
+            for process, _ in self._waiting:
+                process.kill()
+                process.wait()
+            self._waiting.clear()
+        _rmtree(self.directory, ignore_errors=True)
+
+    def serve_forever(self):
+        """Handle jobs until the worker is stopped"""
+        self._ensure_engine()
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:  # listener closed
+                return
+            if self._stopping:
+                connection.close()
+                return
+            handler = threading.Thread(target=self._serve_connection, args=(connection,), daemon=True)
+            with self._lock:
+                self._handlers.add(handler)
+            handler.start()
+
+    def _serve_connection(self, connection):
+        try:
+            with connection:
+                request = connection.recv()
+                connection.send(self._handle(*request))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._handlers.discard(threading.current_thread())
+
+    def _handle(self, command, *args):
+        if command == 'ping':
+            return 'ok', self._ensure_engine()
+        elif command == 'compile':
+            return self._compile(*args)
+        else:
+            return 'error', None, "Unknown command {}".format(command)
+
+    def _start_engine(self):
+        directory = self.directory / 'engine{}'.format(next(self._engine_count))
+        directory.mkdir()
+        # wait for the job at the end of the preamble
+        command = r'\def\endofdump{\read16 to \tikzplotgo}\input{' + self.template.as_posix() + '}'
+        process = _Popen([self.latex, '-interaction=scrollmode', '-halt-on-error', '-jobname=job', command],
+                         cwd=directory, stdin=_PIPE, stdout=_DEVNULL, stderr=_DEVNULL)
+        return process, directory
+
+    def _ensure_engine(self):
+        """Start engines until ``engines`` are waiting and return whether they are running"""
+        with self._lock:
+            for engine in [e for e in self._waiting if e[0].poll() is not None]:
+                self._waiting.remove(engine)
+                _rmtree(engine[1], ignore_errors=True)
+            while len(self._waiting) < max(self.engines, 1) and not self._stopping:
+                self._waiting.append(self._start_engine())
+            return bool(self._waiting) and all(e[0].poll() is None for e in self._waiting)
+
+    def _take_engine(self):
+        """Return a waiting engine (starting one if there is none) and start its replacement"""
+        with self._lock:
+            while self._waiting:
+                process, engine_dir = self._waiting.popleft()
+                if process.poll() is None:
+                    break
+                _rmtree(engine_dir, ignore_errors=True)
+            else:
+                process, engine_dir = self._start_engine()
+        self._ensure_engine()
+        return process, engine_dir
+
+    def _compile(self, directory, jobname):
+        aux = None
+        for _ in range(max(self.max_runs, 1)):
+            status, pdf, log, aux = self._run(Path(directory), jobname, aux)
+            if status != 'ok' or not _rerun_re.search(log):
+                break
+        return status, pdf, log
+
+    def _run(self, directory, jobname, aux):
+        """Compile the job in a waiting engine and return ``(status, pdf, log, aux)``"""
+        process, engine_dir = self._take_engine()
+        try:
+            for path in directory.glob(jobname + '_data*'):
+                _copyfile(path, engine_dir / path.name)
+            _copyfile(directory / (jobname + '.tikz'), engine_dir / 'job.tikz')
+            if (directory / (jobname + '.pre')).exists():
+                _copyfile(directory / (jobname + '.pre'), engine_dir / 'job.pre')
+            if aux is not None:
+                (engine_dir / 'job.aux').write_bytes(aux)
+            try:
+                process.communicate(b'\n', timeout=self.timeout)
+            except _TimeoutExpired:
+                process.kill()
+                process.wait()
+            except OSError:  # engine failed before reading the job
+                process.wait()
+            log_file = engine_dir / 'job.log'
+            log = log_file.read_text(errors='replace') if log_file.exists() else ''
+            if process.returncode != 0 or not (engine_dir / 'job.pdf').exists():
+                return 'error', None, log, None
+            aux_file = engine_dir / 'job.aux'
+            aux = aux_file.read_bytes() if aux_file.exists() else None
+            return 'ok', (engine_dir / 'job.pdf').read_bytes(), log, aux
+        finally:
+            _rmtree(engine_dir, ignore_errors=True)
+
+
+_rerun_re = _re.compile(r'There were undefined references|Label\(s\) may have changed|Rerun to get')
+
+
+class WorkerClient:
+    """Connection to a :class:`CompileWorker`"""
+    def __init__(self, address, authkey, latex='lualatex'):
+        self.address = address
+        self.authkey = authkey
+        self.latex = latex
+
+    def _request(self, *request):
+        with _Client(self.address, authkey=self.authkey) as connection:
+            connection.send(request)
+            return connection.recv()
+
+    def ping(self):
+        """Return whether the worker is reachable and has an engine running (restarting it if necessary)"""
+        try:
+            status, running = self._request('ping')
+        except (OSError, EOFError):
+            return False
+        return status == 'ok' and running
+
+    def compile(self, tikzfile):
+        """Compile ``tikzfile`` (and the data files next to it) and return ``(success, pdf, log)``
+
+        Raises :class:`OSError` or :class:`EOFError` if the worker is not reachable.
+        """
+        tikzfile = Path(tikzfile).resolve()
+        materialize_tables(tikzfile)
+        status, pdf, log = self._request('compile', str(tikzfile.parent), tikzfile.stem)
+        return status == 'ok', pdf, log
+
+
 class Figure(TikzEnvironment):
+    """TikZ figure
+
+    If ``external_data`` is ``True``, plot data is written to table files next to the output file instead of inline
+    coordinates (can be overridden for individual plots).
+
+    ``precision`` and ``float_format`` set the default number format of the plot data (see :class:`Coordinates`).
+
+    ``data_store`` determines how external plot data is stored: as text tables (``'text'``), gzip-compressed tables
+    (``'gzip'``) or NumPy ``.npz`` files (``'npy'``). Compressed and binary files are converted to text tables (see
+    :func:`materialize_tables`) only when compiling. Data files are only rewritten if the data changed.
+
+    Set ``cache`` to a :class:`CompileCache` to reuse previously compiled PDFs in ``save`` if the generated code is
+    unchanged.
+
+    If ``precompile`` is ``True``, ``save`` and ``view`` load the preamble of the template from a precompiled format
+    (built with ``mylatexformat`` below ``workdir_root`` on first use and whenever the template or engine changes).
+    This requires ``latex='pdflatex'``.
+
+    If a :class:`CompileWorker` is running (``worker`` is set), ``save`` compiles with the worker instead of
+    ``latexmk`` (falling back to ``latexmk`` if the worker is not reachable).
+
+    If ``profile`` is ``True`` or a ``stats_callback`` is set, ``save_tikz``, ``save`` and ``view`` collect a
+    :class:`FigureStats` object in ``stats`` and pass it to ``stats_callback(figure, stats)``.
+
+    Embedded matplotlib axes (see :class:`MPLAxisContents`) are rendered in the writing thread by default. Set
+    ``raster_workers`` to render them in parallel using up to that many processes (``None`` for the number of CPUs).
+    The processes are shared by all figures and kept alive between writes. They import the main module like other
+    ``multiprocessing`` workers, so scripts need an ``if __name__ == '__main__':`` guard to render in parallel.
+
+    Working directories for ``save`` and ``view`` are only created when first needed. They are taken from a bounded
+    pool below ``workdir_root`` (defaults to ``$TIKZPLOT_WORKDIR`` or ``tikzplot-<uid>`` in the system temporary
+    directory, created accessible only by the user) and returned to the pool when the figure is deleted.
+    """
     name = "tikzpicture"
     index = 0
     viewdir = default_viewdir
-
-    def __init__(self, *args, **kwargs):
+    workdir_root = default_workdir_root
+    _workdir = None
+    external_data = False
+    precision = None
+    float_format = None
+    data_store = 'text'
+    cache = None
+    precompile = False
+    worker = None
+    raster_workers = 1
+    profile = False
+    stats = None
+    stats_callback = None
+
+    def __init__(self, *args, external_data=None, precision=None, float_format=None, data_store=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.index = Figure.index + 1
-        Figure.index += 1
-        self._wdir = tempfile.TemporaryDirectory(dir=self.viewdir)
-        self._wdirname = Path(self._wdir.name)
+        if data_store is not None:
+            if data_store not in ('text', 'gzip', 'npy'):
+                raise ValueError("Unknown data store {}".format(data_store))
+            self.data_store = data_store
+        if external_data is not None:
+            self.external_data = external_data
+        if precision is not None:
+            self.precision = precision
+        if float_format is not None:
+            self.float_format = float_format
+        with _figure_index_lock:
+            Figure.index += 1
+            self.index = Figure.index
+
+    @property
+    def _wdirname(self):
+        """working directory, taken from the pool on first use and returned when the figure is deleted"""
+        if self._workdir is None:
+            with _workdir_lock:
+                if self._workdir is None:
+                    workdir = _workdir_pool.acquire(self.workdir_root)
+                    weakref.finalize(self, _workdir_pool.release, workdir)
+                    self._workdir = workdir
+        return self._workdir
 
     def axis(self, *args, **kwargs):
         ax = Axis(*args, **kwargs)
@@ -232,45 +1202,287 @@ class Figure(TikzEnvironment):
         self.children.append(ax)
         return ax
 
-    def save_tikz(self, filename):
-        with open(filename, 'w') as f:
-            self.write(f)
+    def write(self, file):
+        if not isinstance(file, _FigureWriter):
+            file = _FigureWriter(file)
+        file.external_data = self.external_data
+        file.precision = self.precision
+        file.float_format = self.float_format
+        file.data_store = self.data_store
+        if self.raster_workers != 1:
+            _render_parallel((e for e in _iter_elements(self) if isinstance(e, MPLAxisContents)), self.raster_workers)
+        super().write(file)
 
-    def view(self, latex='lualatex'):
-        with open(self._wdirname / 'Figure_{}.tikz'.format(self.index), 'w') as f:
-            self.write(f)
+    def save_tikz(self, filename):
+        stats = self._start_stats()
+        with _phase(stats, 'write'), open(filename, 'w', buffering=_buffer_size) as f:
+            self.write(_FigureWriter(f, stats=stats))
+        self._report_stats()
+
+    def _write_tikz(self, filename):
+        """Write the figure to ``filename`` and return the list of external data files"""
+        with _phase(self.stats, 'write'), open(filename, 'w', buffering=_buffer_size) as f:
+            writer = _FigureWriter(f, stats=self.stats)
+            self.write(writer)
+        return writer.ext_files
+
+    def _start_stats(self):
+        self.stats = FigureStats() if self.profile or self.stats_callback is not None else None
+        return self.stats
+
+    def _read_log(self):
+        with open(self._wdirname / 'Figure_{}.log'.format(self.index)) as f:
+            log = f.read()
+        if self.stats is not None:
+            self.stats.tex_memory = _tex_memory(log)
+        return log
+
+    def _report_stats(self):
+        # look up the callback without binding it when set on the class
+        callback = vars(self).get('stats_callback', type(self).stats_callback)
+        if self.stats is not None and callback is not None:
+            callback(self, self.stats)
+
+    def _cache_key(self, cache, latex, ext_files):
+        return cache.key(self._wdirname / 'Figure_{}.tikz'.format(self.index), self.viewdir / 'viewtemplate.tex',
+                         latex, ext_files)
+
+    def view(self, latex='lualatex', cache=None):
+        if cache is None:
+            cache = self.cache
+        stats = self._start_stats()
+        ext_files = self._write_tikz(self._wdirname / 'Figure_{}.tikz'.format(self.index))
         verbosity = '-silent'
-        rv = _run(['latexmk', "-{}".format(latex), "-pv", verbosity, "-jobname=Figure_{}".format(self.index),
-                   self.viewdir / 'viewtemplate.tex'], cwd=self._wdir.name)
-        if rv.returncode != 0:
-            with open(self._wdirname / 'Figure_{}.log'.format(self.index)) as f:
-                print(f.read())
-
-    def save(self, filename, latex='lualatex'):
-        with open(self._wdirname / 'Figure_{}.tikz'.format(self.index), 'w') as f:
-            self.write(f)
-        rv = _run(['latexmk', "-{}".format(latex), "-silent", "-jobname=Figure_{}".format(self.index),
-                  self.viewdir / 'viewtemplate.tex'], cwd=self._wdir.name)
+        with _phase(stats, 'compile'):
+            rv = _latexmk_externalized(latex, "Figure_{}".format(self.index), self.viewdir / 'viewtemplate.tex',
+                                       self._wdirname, "-pv", verbosity, precompile=self.precompile)
         if rv.returncode != 0:
-            with open(self._wdirname / 'Figure_{}.log'.format(self.index)) as f:
-                print(f.read())
+            print(self._read_log())
         else:
-            _copyfile(self._wdirname / 'Figure_{}.pdf'.format(self.index), filename)
+            if stats is not None:
+                self._read_log()
+            if cache is not None:
+                cache.put(self._cache_key(cache, latex, ext_files),
+                          self._wdirname / 'Figure_{}.pdf'.format(self.index))
+        self._report_stats()
+
+    def save(self, filename, latex='lualatex', cache=None):
+        try:
+            self._compile(filename, latex, cache)
+        except CompileError as e:
+            print(e.log)
+
+    def _compile(self, filename, latex='lualatex', cache=None):
+        """Compile the figure and copy the result to ``filename`` (raises :class:`CompileError` on failure)"""
+        if cache is None:
+            cache = self.cache
+        stats = self._start_stats()
+        try:
+            self._compile_stages(filename, latex, cache, stats)
+        finally:
+            self._report_stats()
+
+    def _compile_with_worker(self, latex):
+        """Compile using the worker and return the exit status (``None`` if the worker cannot be used)"""
+        worker = self.worker
+        if worker is None or worker.latex != latex:
+            return None
+        try:
+            success, pdf, log = worker.compile(self._wdirname / 'Figure_{}.tikz'.format(self.index))
+        except (OSError, EOFError):
+            return None
+        with open(self._wdirname / 'Figure_{}.log'.format(self.index), 'w') as f:
+            f.write(log)
+        if success:
+            with open(self._wdirname / 'Figure_{}.pdf'.format(self.index), 'wb') as f:
+                f.write(pdf)
+        return 0 if success else 1
+
+    def _compile_stages(self, filename, latex, cache, stats):
+        ext_files = self._write_tikz(self._wdirname / 'Figure_{}.tikz'.format(self.index))
+        if cache is not None:
+            with _phase(stats, 'cache'):
+                key = self._cache_key(cache, latex, ext_files)
+                cached = cache.get(key)
+            if cached is not None:
+                with _phase(stats, 'copy'):
+                    _copyfile(cached, filename)
+                return
+        with _phase(stats, 'compile'):
+            returncode = self._compile_with_worker(latex)
+            if returncode is None:
+                returncode = _latexmk_externalized(
+                    latex, "Figure_{}".format(self.index), self.viewdir / 'viewtemplate.tex', self._wdirname,
+                    "-silent", precompile=self.precompile).returncode
+        if returncode != 0:
+            raise CompileError("Compilation of Figure_{} failed".format(self.index), self._read_log())
+        else:
+            if stats is not None:
+                self._read_log()
+            with _phase(stats, 'copy'):
+                if cache is not None:
+                    cache.put(key, self._wdirname / 'Figure_{}.pdf'.format(self.index))
+                _copyfile(self._wdirname / 'Figure_{}.pdf'.format(self.index), filename)
+
+
+def save_all(figures, filenames, latex='lualatex', max_workers=None, cache=None):
+    """Compile and save several figures concurrently.
+
+    Each figure is compiled in its own working directory using a pool of ``max_workers`` threads. Returns a list with
+    one entry per figure in submission order, which is ``None`` if the figure was saved successfully and the raised
+    exception (usually a :class:`CompileError`) otherwise.
+    """
+    figures = list(figures)
+    filenames = list(filenames)
+    if len(figures) != len(filenames):
+        raise ValueError("number of figures and file names does not match")
+
+    def save(figure, filename):
+        try:
+            figure._compile(filename, latex, cache)
+        except Exception as e:
+            return e
+        return None
+
+    with _ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(save, figures, filenames))
+
+
+def save_batch(figures, filenames, latex='lualatex', externalize=False, max_workers=None, external_dir=None):
+    """Compile several figures as a single document and save one PDF per figure.
+
+    All figures are written to one file and compiled with a single LaTeX run (one page per figure using the ``multi``
+    mode of the ``standalone`` class), such that the preamble is only loaded once. The resulting PDF is then split
+    into the individual files (using ``pypdf`` if installed and ``pdfseparate`` otherwise). Raises
+    :class:`CompileError` if compilation fails.
+
+    If ``externalize`` is ``True``, each figure is compiled separately using the tikz ``external`` library (with up to
+    ``max_workers`` parallel jobs, defaulting to the number of CPUs) and figures whose code did not change since the
+    last batch are reused. The compiled figures are kept in ``external_dir``, which must not be shared by concurrent
+    processes (defaults to a directory of this process below ``Figure.workdir_root`` that is removed at exit).
+    """
+    figures = list(figures)
+    filenames = list(filenames)
+    if len(figures) != len(filenames):
+        raise ValueError("number of figures and file names does not match")
+
+    wdir = _workdir_pool.acquire(Figure.workdir_root)
+    try:
+        with open(wdir / 'Batch.tikz', 'w') as f:
+            writer = _FigureWriter(f)
+            for figure in figures:
+                figure.write(writer)
+        rv = _latexmk_externalized(latex, "Batch", Figure.viewdir / 'viewtemplate.tex', wdir, "-silent",
+                                   r"-usepretex=\PassOptionsToClass{multi=tikzpicture}{standalone}",
+                                   externalize=externalize, max_workers=max_workers,
+                                   external_dir=external_dir)
+        if rv.returncode != 0:
+            with open(wdir / 'Batch.log') as f:
+                raise CompileError("Compilation of figure batch failed", f.read())
+        _split_pdf(wdir / 'Batch.pdf', filenames)
+    finally:
+        _workdir_pool.release(wdir)
+
+
+def _split_pdf(pdf, filenames):
+    """Save each page of ``pdf`` as a separate file"""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        for page, filename in enumerate(filenames, 1):
+            rv = _run(['pdfseparate', '-f', str(page), '-l', str(page), pdf, filename])
+            if rv.returncode != 0:
+                raise RuntimeError("Failed to extract page {} of {}".format(page, pdf))
+        return
+
+    reader = PdfReader(pdf)
+    if len(reader.pages) != len(filenames):
+        raise RuntimeError("Expected {} pages but {} has {}".format(len(filenames), pdf, len(reader.pages)))
+    for page, filename in zip(reader.pages, filenames):
+        writer = PdfWriter()
+        writer.add_page(page)
+        with open(filename, 'wb') as f:
+            writer.write(f)
+
+
+def _has_matplotlib():
+    try:
+        import matplotlib
+    except ImportError:
+        return False
+    return True
 
 
 class Axis(TikzEnvironment):
+    """pgfplots axis
+
+    ``plot``, ``errorplot`` and ``bar`` support reducing the number of points using ``downsample='lttb'``
+    (largest-triangle-three-buckets), ``'minmax'`` (minimum and maximum per horizontal pixel bucket) or ``'stride'``
+    (every n-th point). The target number of points is given by ``max_points`` or derived from the axis width at
+    ``downsample_dpi`` points per inch. Downsampling requires NumPy.
+
+    ``imshow`` embeds numeric matrices with more than ``raster_threshold`` cells as PNG image (see
+    :class:`RasterImage`) if matplotlib is installed, as pgfplots runs out of memory for large matrix plots. The image
+    uses the colormap of the axis (``cmap`` defaults to the matplotlib equivalent of the active ``colormap/<name>``,
+    e.g. ``'hot'`` for ``colormap/hot2``, and to ``'viridis'`` if no colormap is set). A ``cmap`` that does not match
+    the named colormap of the axis raises :class:`ValueError`; for a custom colormap of the axis, pass the matching
+    matplotlib ``cmap``.
+
+    ``plot`` reads iterators into columns. With ``stream=True``, the data is instead read in chunks while writing
+    (see :class:`Coordinates`) and the plot can only be written once.
+    """
     name = "axis"
-
-    def plot(self, x, y, *args, meta=None, error=None, **kwargs):
-        p = CPlot(Coordinates(zip(x, y), error=error, meta=meta), *args, **kwargs)
+    downsample_dpi = 150
+    raster_threshold = 100000
+    _violin_count = 0  # number of violins added using violin/violins (determines the default location)
+
+    def plot(self, x, y, *args, meta=None, error=None, external=None, downsample=None, max_points=None,
+             precision=None, float_format=None, stream=False, **kwargs):
+        point_counts = None
+        if downsample is not None:
+            x, y = _as_column(x), _as_column(y)
+            index = self._downsample_index(x, y, downsample, max_points)
+            point_counts = (len(x), len(index))
+            x, y = x[index], y[index]
+            if error is not None:
+                error = _as_column(error)[index]
+            if meta is not None:
+                meta = _as_column(meta)[index]
+        p = CPlot(Coordinates.from_columns(x, y, error=error, meta=meta, external=external, precision=precision,
+                                           float_format=float_format, stream=stream), *args, **kwargs)
+        p.point_counts = point_counts
         self.children.append(p)
         return p
 
-    def errorplot(self, x, y, e, *args, **kwargs):
+    def errorplot(self, x, y, e, *args, downsample=None, max_points=None, **kwargs):
+        point_counts = None
+        if downsample is not None:
+            x, y = _as_column(x), _as_column(y)
+            index = self._downsample_index(x, y, downsample, max_points)
+            point_counts = (len(x), len(index))
+            x, y, e = x[index], y[index], _as_column(e)[index]
         p = ErrorPlot(x, y, e, *args, **kwargs)
+        p.point_counts = point_counts
         self.children.append(p)
         return p
 
+    @property
+    def width_points(self):
+        """Number of points corresponding to the horizontal resolution of the axis"""
+        width = None
+        if 'width' in self and isinstance(self['width'], Value):
+            width = _length_in_inches(self['width'].value)
+        if width is None:
+            width = 240 / 72.27  # pgfplots default width
+        return int(width * self.downsample_dpi)
+
+    def _downsample_index(self, x, y, method, max_points=None):
+        if _np is None:
+            raise ImportError("downsampling requires NumPy")
+        if max_points is None:
+            max_points = self.width_points
+        return _downsample_index(x, y, max_points, method)
+
     def bar(self, x, y, *args, **kwargs):
         p = self.plot(x, y, 'ybar', 'ybar legend', 'fill', *args, mark='none', **kwargs)
         return p
@@ -279,78 +1491,172 @@ class Axis(TikzEnvironment):
         p = self.plot(x, y, 'xbar', 'xbar legend', 'fill', *args, mark='none', **kwargs)
         return p
 
-    def imshow(self, matrix, *args, colormodel=None, x=None, y=None, **kwargs):
-        if x is None:
-            x = range(len(matrix[0]))
-        elif len(x) != len(matrix[0]):
-            if len(x) == 2:
-                step = (x[1]-x[0]) / len(matrix[0])
-                x = [x[0] + i * step for i in range(len(matrix[0]))]
-            else:
-                raise ValueError("Provided x value does not match matrix size")
-
-        if y is None:
-            y = range(len(matrix))
-        elif len(y) != len(matrix):
-            if len(y) == 2:
-                step = (y[1]-y[0]) / len(matrix)
-                y = [y[0] + i * step for i in range(len(matrix))]
-            else:
-                raise ValueError("Provided y value does not match matrix size")
-
-        x_list = []
-        y_list = []
-        m_list = []
-
-        for yi, row in zip(y, matrix):
-            for xi, m in zip(x, row):
-                x_list.append(xi)
-                y_list.append(yi)
-                m_list.append(m)
-
-        if colormodel is not None:
-            m_list = ["{}={}".format(colormodel, mv) for mv in m_list]
-            opts = {"point meta": "explicit symbolic", "mesh/color input": "explicit"}
-        elif isinstance(matrix[0][0], Number):
+    def imshow(self, matrix, *args, colormodel=None, x=None, y=None, external=None, max_size=None, raster=None,
+               cmap=None, precision=None, float_format=None, **kwargs):
+        data = MatrixData(matrix, x, y, colormodel=colormodel, max_size=max_size, external=external,
+                          precision=precision, float_format=float_format)
+        rasterizable = colormodel is None and data.numeric
+        if raster is None:
+            raster = rasterizable and len(data) > self.raster_threshold and _has_matplotlib()
+        elif raster and not rasterizable:
+            raise ValueError("Only numeric matrices without colormodel can be rasterized")
+        if raster:
+            axis_cmap = self._colormap()
+            matplotlib_cmaps = {name: cm for cm, name in _pgfplots_colormaps.items()}
+            if cmap is None:
+                if axis_cmap is not None and axis_cmap not in matplotlib_cmaps:
+                    raise ValueError("No matplotlib equivalent of the axis colormap {!r}, pass cmap to rasterize"
+                                     .format(axis_cmap or 'custom'))
+                cmap = matplotlib_cmaps.get(axis_cmap, 'viridis')
+            elif axis_cmap and axis_cmap != _pgfplots_colormaps.get(cmap):
+                raise ValueError("cmap {!r} does not match the axis colormap {!r}".format(cmap, axis_cmap))
+            image = RasterImage(data, cmap=cmap, vmin=self._option_value('point meta min'),
+                                vmax=self._option_value('point meta max'))
+            self['point meta min'] = image.vmin
+            self['point meta max'] = image.vmax
+            if axis_cmap is None and cmap in _pgfplots_colormaps:
+                self['colormap/' + _pgfplots_colormaps[cmap]] = None
+            p = Plot(image, *args, **kwargs)
+            self.children.append(p)
+            return p
+
+        if colormodel is None and data.numeric:
             opts = {"point meta": "explicit"}
         else:
             opts = {"point meta": "explicit symbolic", "mesh/color input": "explicit"}
-        opts['mesh/cols'] = len(matrix[0])
+        opts['mesh/cols'] = data.shape[1]
         opts['line join'] = 'miter'
-        p = Plot(Coordinates(zip(x_list, y_list), meta=m_list), "matrix plot", "no marks", opts, *args, **kwargs)
+        p = Plot(data, "matrix plot", "no marks", opts, *args, **kwargs)
         self.children.append(p)
+        return p
+
+    def _option_value(self, key):
+        if key in self:
+            return self[key].value
+        return None
+
+    def _colormap(self):
+        """Name of the colormap set for the axis (``''`` if it has no name and ``None`` if no colormap is set)"""
+        for key in self.options:
+            key = str(key)
+            if key.startswith('colormap/'):
+                return key[len('colormap/'):]
+            elif key == 'colormap name':
+                return str(self._option_value(key))
+            elif key.startswith('colormap'):
+                return ''
+        return None
 
     def violin(self, data,  *args, location=None, orientation='vertical', kd_options=None, grid=100,
                width=0.8, expand_range=3, xmin=None, xmax=None, legendentry=None, texlabel=None, **kwargs):
-        data = list(data)
+        if _np is None:
+            raise ImportError("violin requires NumPy")
+        data = _np.asarray(_as_column(data), dtype=float)
         if len(data) > 1:
-            kd_params = {'bandwidth': 1.06*stdev(data) * len(data)**(-1/5)}
+            kd_params = {'bandwidth': 1.06*_np.std(data, ddof=1) * len(data)**(-1/5)}
         else:
             kd_params = {'bandwidth': 1e-5}
 
         if kd_options is not None:
             kd_params.update(kd_options)
-        kde = KernelDensity(**kd_params)
+        if _use_native_kde(kd_params):
+            kde = None
+            bandwidth = kd_params['bandwidth']
+        else:
+            from sklearn.neighbors import KernelDensity  # imported on first use as it is slow to load
+            kde = KernelDensity(**kd_params)
+            kde.fit(_np.reshape(data, (-1, 1)))
+            bandwidth = getattr(kde, 'bandwidth_', kde.bandwidth)
 
         if location is None:
-            location = sum(isinstance(c, Violin) for c in self.children)
+            location = self._violin_count
 
         sf = 0.5*width
-        kde.fit([[di] for di in data])
         if xmin is None:
-            xmin = min(data) - expand_range*kde.bandwidth
+            xmin = data.min() - expand_range*bandwidth
         if xmax is None:
-            xmax = max(data) + expand_range*kde.bandwidth
+            xmax = data.max() + expand_range*bandwidth
         step = (xmax - xmin) / grid
         x = [xmin + i*step for i in range(grid)]
-        y = kde.score_samples([[xi] for xi in x])
-        my = max(y)
-        y[:] = [exp(v-my) * sf for v in y]
+        if kde is None:
+            y = _binned_gaussian_kde(data, xmin, step, grid, bandwidth)
+            my = y.max()
+            if my > 0:
+                y *= sf / my
+        else:
+            y = kde.score_samples(_np.reshape(x, (-1, 1)))
+            my = max(y)
+            y[:] = [exp(v-my) * sf for v in y]
         p = Violin(x, y, *args, location=location, orientation=orientation, line_options=None, violin_options=None,
              texlabel=texlabel, legendentry=legendentry, **kwargs)
         self.children.append(p)
+        self._violin_count += 1
         return p
 
+    def violins(self, groups, *args, locations=None, orientation='vertical', kd_options=None, grid=100, width=0.8,
+                expand_range=3, xmin=None, xmax=None, max_workers=None, **kwargs):
+        """Add one violin per group of data.
+
+        ``groups`` is a mapping of data sets, a sequence of data sets or a 2-d array (one group per row). The
+        densities of all groups are evaluated on a shared grid in one vectorized batch (split across
+        ``max_workers`` threads if given). Returns the list of :class:`Violin` plots. Requires NumPy.
+        """
+        if _np is None:
+            raise ImportError("violins requires NumPy")
+        if isinstance(groups, _type.Mapping):
+            groups = list(groups.values())
+        groups = [_np.asarray(g, dtype=float).ravel() for g in groups]
+        if any(len(g) == 0 for g in groups):
+            raise ValueError("violins requires non-empty groups")
+        if locations is None:
+            locations = range(self._violin_count, self._violin_count + len(groups))
+
+        bandwidths = _np.array([1.06 * g.std(ddof=1) * len(g)**(-1/5) if len(g) > 1 else 1e-5 for g in groups])
+        kd_params = dict(kd_options) if kd_options is not None else {}
+        bandwidth = kd_params.pop('bandwidth', None)
+        rule = isinstance(bandwidth, str)  # bandwidth rule such as 'scott', left to scikit-learn
+        if bandwidth is not None and not rule:
+            bandwidths[:] = bandwidth
+        kdes = None
+        if rule or not _use_native_kde(dict(kd_params, bandwidth=1.0)):
+            from sklearn.neighbors import KernelDensity
+            kdes = [KernelDensity(**kd_params, bandwidth=bandwidth if rule else b).fit(g.reshape(-1, 1))
+                    for g, b in zip(groups, bandwidths)]
+            bandwidths = _np.array([getattr(kde, 'bandwidth_', kde.bandwidth) for kde in kdes])
+
+        if xmin is None:
+            xmin = min(g.min() for g in groups) - expand_range*bandwidths.max()
+        if xmax is None:
+            xmax = max(g.max() for g in groups) + expand_range*bandwidths.max()
+        step = (xmax - xmin) / grid
+        x = [xmin + i*step for i in range(grid)]
+
+        if kdes is None:
+            if max_workers is None or len(groups) < 2:
+                densities = _binned_gaussian_kdes(groups, xmin, step, grid, bandwidths)
+            else:
+                chunks = _np.array_split(_np.arange(len(groups)), min(max_workers, len(groups)))
+                with _ThreadPoolExecutor(max_workers) as executor:
+                    results = executor.map(_binned_gaussian_kdes, ([groups[i] for i in c] for c in chunks),
+                                           _repeat(xmin), _repeat(step), _repeat(grid), (bandwidths[c] for c in chunks))
+                    densities = _np.concatenate(list(results))
+        else:
+            densities = []
+            for kde in kdes:
+                log_density = kde.score_samples(_np.reshape(x, (-1, 1)))
+                densities.append(_np.exp(log_density - log_density.max()))
+            densities = _np.array(densities)
+
+        peak = densities.max(axis=1, keepdims=True)
+        densities = densities * (0.5*width / _np.where(peak > 0, peak, 1))
+        plots = []
+        for location, y in zip(locations, densities):
+            p = Violin(x, y, *args, location=location, orientation=orientation, **kwargs)
+            self.children.append(p)
+            plots.append(p)
+        self._violin_count += len(plots)
+        return plots
+
     def graphic(self, filename, graphic_options, *args, **kwargs):
         p = Plot(Graphic(filename, graphic_options), *args, **kwargs)
         self.children.append(p)
@@ -487,15 +1793,17 @@ class GroupPlot(TikzEnvironment):
         self.children.append(ax)
         return ax
 
-    def write(self, file):
-        if 'group style' in self:
-            go = self['group style']
+    def write_options(self, file):
+        options = OptionList(*self._inherited(), self.options)
+        if 'group style' in options:
+            go = options['group style']
             if not ('group size' in go or 'columns' in go or 'rows' in go):
-                go['columns'] = self.cols
-                go['rows'] = self.rows
+                options['group style'] = OptionList(go, columns=self.cols, rows=self.rows)
         else:
-            self['group style'] = {'columns': self.cols, 'rows': self.rows}
+            options['group style'] = {'columns': self.cols, 'rows': self.rows}
+        options.write(file)
 
+    def write(self, file):
         file.write(r'\begin{scope}[local bounding box=gbox]')
         super().write(file)
         file.write(r'\end{scope}')
@@ -548,6 +1856,7 @@ class LegendEntry(TikzCommand):
 
 class Plot(TikzCommand):
     name = "addplot"
+    point_counts = None  # (original, reduced) number of points if the data was downsampled
 
     def __init__(self, plot_data, *args, texlabel=None, legendentry=None, **kwargs):
         super().__init__(*args, **kwargs)
@@ -595,45 +1904,313 @@ class Graphic(TikzElement):
         self.filename = filename
 
     def write(self, file):
+        _register_ext_file(file, Path(self.filename))
+        self._write_graphic(file, self.filename)
+
+    def _write_graphic(self, file, filename, options=None):
         file.write(" ")
         file.write(self.name)
-        self.options.write(file)
-        file.write('{"' + str(self.filename) + '"};')
+        (self.options if options is None else options).write(file)
+        file.write('{"' + str(filename) + '"};')
 
 
 class MPLAxisContents(Graphic):
+    """Contents of a matplotlib axis (without ticks, labels and frame) embedded as image
+
+    Rendered images are cached by a fingerprint of the axis contents, extent and dpi, such that writing unchanged
+    contents again does not render them again. The fingerprint covers the rendering state of the artists (data,
+    styles, fonts, norms, transforms, path effects) and the matplotlib rc settings; call :func:`clear_raster_cache`
+    after changing state it cannot see, e.g. of custom artists.
+    """
     def __init__(self, axis, *args, filename=None, dpi=None, **kwargs):
         super().__init__(filename=filename, *args, **kwargs)
         self.axis = axis
         self.dpi = dpi
 
+    def _format(self):
+        return (Path(self.filename).suffix[1:] if self.filename is not None else None) or 'png'
+
+    def _raster_key(self):
+        with _mpl_lock:
+            return _axis_fingerprint(self.axis, self._format(), self.dpi)
+
     def write(self, file):
         xmin, xmax = self.axis.get_xlim()
         ymin, ymax = self.axis.get_ylim()
-        self['xmin'] = xmin
-        self['xmax'] = xmax
-        self['ymin'] = ymin
-        self['ymax'] = ymax
-        old_fname = self.filename
+        options = OptionList(self.options, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
         if self.filename is None:
-            if hasattr(file, 'name'):
-                fname = Path(file.name).resolve()
-                filename = fname.with_name("{}_data{}.png".format(fname.stem, _ext_file_counter[fname]))
-                self.filename = filename.name
-            else:
-                raise RuntimeError("Need explicit file name when writing to file-like object without name")
+            filename = _ext_filename(file, '.png')
         else:
             filename = Path(self.filename)
-
-        ax_state = self.axis.axison
+            _register_ext_file(file, filename)
+
+        key = self._raster_key()
+        image = _cached_raster(key)
+        if image is None:
+            # matplotlib figures are not thread-safe and the axis is hidden temporarily while rendering
+            with _mpl_lock:
+                image = _render_axis(self.axis, self._format(), self.dpi)
+            _cache_raster(key, image)
+        if not (filename.is_file() and filename.stat().st_size == len(image) and filename.read_bytes() == image):
+            filename.write_bytes(image)
+        self._write_graphic(file, filename.name if self.filename is None else self.filename, options)
+
+
+def _render_axis(axis, fmt, dpi):
+    """Render the contents of a matplotlib axis and return the image file as bytes"""
+    ax_state = axis.axison
+    if ax_state:
+        axis.set_axis_off()
+    try:
+        extent = _axis_extent(axis)
+        buffer = _BytesIO()
+        axis.figure.savefig(buffer, format=fmt, bbox_inches=extent, transparent=True, dpi=dpi)
+    finally:
         if ax_state:
-            self.axis.set_axis_off()
-        extent = self.axis.get_window_extent().transformed(self.axis.figure.dpi_scale_trans.inverted())
-        self.axis.figure.savefig(filename, bbox_inches=extent, transparent=True, dpi=self.dpi)
-        super().write(file)
-        self.filename = old_fname
-        if ax_state:
-            self.axis.set_axis_on()
+            axis.set_axis_on()
+    return buffer.getvalue()
+
+
+def _axis_extent(axis):
+    """Extent of a matplotlib axis in inches, after applying its aspect ratio as drawing would"""
+    axis.apply_aspect()
+    return axis.get_window_extent().transformed(axis.figure.dpi_scale_trans.inverted())
+
+
+def _render_figure_axes(figure, jobs, rc):
+    """Render axes of a (pickled) matplotlib figure in a worker process
+
+    ``jobs`` is a list of ``(index, fmt, dpi)`` and ``rc`` the rcParams of the writing process.
+    """
+    from matplotlib import rc_context
+    with rc_context(rc):
+        return [_render_axis(figure.axes[index], fmt, dpi) for index, fmt, dpi in jobs]
+
+
+def _rc_params():
+    """rcParams that affect rendering, as a plain dict"""
+    from matplotlib import rcParams
+    return {key: value for key, value in dict.items(rcParams) if key != 'backend'}
+
+
+def _render_parallel(elements, max_workers=None):
+    """Render the images of all :class:`MPLAxisContents` in ``elements`` that are not cached in worker processes
+
+    Axes of the same matplotlib figure are rendered by one job, such that each figure is pickled once. Workers
+    render with the rcParams of the writing process. Does nothing if the figures cannot be pickled; the images are
+    then rendered one after another when writing.
+    """
+    pending = {}
+    for element in elements:
+        key = element._raster_key()
+        if key not in pending and _cached_raster(key) is None:
+            pending[key] = element
+    jobs = {}
+    for key, e in pending.items():
+        figure = e.axis.figure
+        keys, specs = jobs.setdefault(id(figure), (figure, [], []))[1:]
+        keys.append(key)
+        specs.append((figure.axes.index(e.axis), e._format(), e.dpi))
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if workers < 2:
+        return
+    executor = _raster_executor(workers)
+    try:
+        rc = _rc_params()
+        futures = [(keys, executor.submit(_render_figure_axes, figure, specs, rc))
+                   for figure, keys, specs in jobs.values()]
+        for keys, future in futures:
+            for key, image in zip(keys, future.result()):
+                _cache_raster(key, image)
+    except _BrokenProcessPool:
+        _shutdown_raster_pool(executor)
+    except (_PicklingError, TypeError, AttributeError):
+        pass
+
+
+def _raster_executor(workers):
+    """Process pool for rendering shared by all figures, kept alive between writes
+
+    Worker processes are started with ``forkserver`` (or ``spawn`` where it is not available), as forking a
+    process with running threads may deadlock. The pool is replaced by a larger one if more workers are requested.
+    """
+    global _raster_pool
+    with _raster_pool_lock:
+        pool = _raster_pool
+        if pool is None or pool[1] != os.getpid() or pool[2] < workers:
+            if pool is not None and pool[1] == os.getpid():
+                pool[0].shutdown(wait=False)  # running renders still finish
+            method = 'forkserver' if 'forkserver' in _start_methods() else 'spawn'
+            pool = (_ProcessPoolExecutor(workers, mp_context=_mp_context(method)), os.getpid(), workers)
+            _raster_pool = pool
+        return pool[0]
+
+
+def _shutdown_raster_pool(executor=None):
+    """Shut down the rendering pool (only if it is still ``executor`` when given)"""
+    global _raster_pool
+    with _raster_pool_lock:
+        pool = _raster_pool
+        if pool is None or (executor is not None and pool[0] is not executor):
+            return
+        _raster_pool = None
+    if pool[1] == os.getpid():
+        pool[0].shutdown(wait=executor is None)
+
+
+_atexit.register(_shutdown_raster_pool)
+
+
+def _cached_raster(key):
+    with _raster_lock:
+        image = _raster_cache.get(key)
+        if image is not None:
+            _raster_cache.move_to_end(key)
+        return image
+
+
+def _cache_raster(key, image):
+    with _raster_lock:
+        _raster_cache[key] = image
+        total = sum(map(len, _raster_cache.values()))
+        while total > _raster_cache_size and len(_raster_cache) > 1:
+            total -= len(_raster_cache.popitem(last=False)[1])
+
+
+def clear_raster_cache():
+    """Remove all cached images of matplotlib axis contents (see :class:`MPLAxisContents`)"""
+    with _raster_lock:
+        _raster_cache.clear()
+
+
+# properties of common matplotlib artists that determine how they are rendered
+_raster_properties = ('visible', 'zorder', 'alpha', 'clip_on', 'rasterized', 'antialiased', 'xydata', 'color',
+                      'linewidth', 'linestyle', 'drawstyle', 'marker', 'markersize', 'markevery', 'markerfacecolor',
+                      'markeredgecolor', 'markeredgewidth', 'markerfacecoloralt', 'fillstyle', 'gapcolor',
+                      'dash_capstyle', 'dash_joinstyle', 'solid_capstyle', 'solid_joinstyle', 'capstyle', 'joinstyle',
+                      'array', 'clim', 'cmap', 'extent', 'interpolation', 'interpolation_stage', 'resample',
+                      'filternorm', 'filterrad', 'coordinates', 'offsets', 'sizes', 'paths', 'facecolor', 'edgecolor',
+                      'fill', 'hatch', 'path', 'xy', 'width', 'height', 'angle', 'text', 'position', 'fontsize',
+                      'fontproperties', 'rotation', 'rotation_mode', 'transform_rotates_text', 'horizontalalignment',
+                      'verticalalignment', 'multialignment', 'linespacing', 'wrap', 'usetex', 'parse_math',
+                      'backgroundcolor', 'bbox_patch', 'transform', 'offset_transform', 'clip_box', 'clip_path',
+                      'path_effects', 'sketch_params', 'snap', 'agg_filter')
+# rendering state without public getters
+_raster_attributes = ('norm', '_unscaled_dash_pattern', '_us_dashes')
+
+
+def _axis_fingerprint(axis, fmt, dpi):
+    """Hash of everything that affects the rendered contents of a matplotlib axis"""
+    h = hashlib.sha256()
+    extent = _axis_extent(axis)
+    _hash_value(h, (fmt, dpi, axis.figure.dpi, tuple(extent.bounds), axis.get_xlim(), axis.get_ylim(),
+                    axis.get_xscale(), axis.get_yscale(), axis.name, repr(sorted(_rc_params().items()))))
+    hidden = {id(a) for a in (getattr(axis, 'xaxis', None), getattr(axis, 'yaxis', None), *axis.spines.values())}
+    for artist in axis.get_children():
+        if id(artist) not in hidden:  # ticks and frame are not rendered
+            _hash_artist(h, artist)
+    return h.hexdigest()
+
+
+def _hash_artist(h, artist):
+    h.update(type(artist).__name__.encode())
+    for name in _raster_properties:
+        getter = getattr(artist, 'get_' + name, None)
+        if getter is not None:
+            try:
+                value = getter()
+            except (TypeError, ValueError, AttributeError):
+                continue
+            h.update(name.encode())
+            _hash_value(h, value)
+    for name in _raster_attributes:
+        value = getattr(artist, name, None)
+        if value is not None:
+            h.update(name.encode())
+            _hash_value(h, value)
+    for child in artist.get_children():
+        _hash_artist(h, child)
+
+
+def _hash_value(h, value, nested=False):
+    if value is None or isinstance(value, (str, Number)):
+        h.update(repr(value).encode())
+    elif _np is not None and isinstance(value, _np.ndarray):
+        h.update('{}{}'.format(value.dtype, value.shape).encode())
+        h.update(_np.ascontiguousarray(_np.ma.getdata(value)).tobytes())
+        if _np.ma.is_masked(value):
+            h.update(_np.ma.getmaskarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        h.update(b'(')
+        for v in value:
+            _hash_value(h, v, nested)
+        h.update(b')')
+    elif isinstance(value, dict):
+        _hash_value(h, sorted((repr(k), v) for k, v in value.items()), nested)
+    elif hasattr(value, 'vertices'):  # Path
+        _hash_value(h, (value.vertices, value.codes))
+    elif hasattr(value, 'get_fully_transformed_path'):  # TransformedPath
+        _hash_value(h, value.get_fully_transformed_path())
+    elif hasattr(value, 'get_affine'):  # Transform
+        h.update(type(value).__name__.encode())
+        _hash_value(h, value.get_affine().get_matrix())
+        if not value.is_affine:
+            h.update(repr(value).encode())
+    elif hasattr(value, 'bounds') and hasattr(value, 'get_points'):  # Bbox
+        _hash_value(h, tuple(value.bounds))
+    elif hasattr(value, 'get_size_in_points'):  # FontProperties
+        _hash_value(h, (value.get_family(), value.get_style(), value.get_variant(), value.get_weight(),
+                        value.get_stretch(), value.get_size_in_points(), value.get_file(),
+                        getattr(value, 'get_math_fontfamily', lambda: None)()))
+    elif hasattr(value, 'name') and hasattr(value, 'N'):  # Colormap
+        _hash_value(h, (value.name, value.N, value(_np.arange(value.N)), value.get_bad(), value.get_under(),
+                        value.get_over()))
+    elif hasattr(value, 'get_children') and hasattr(value, 'draw'):  # Artist
+        _hash_artist(h, value)
+    else:
+        h.update(type(value).__name__.encode())
+        if not nested and hasattr(value, '__dict__'):  # e.g. norms and path effects
+            _hash_value(h, vars(value), True)
+
+
+class RasterImage(Graphic):
+    """Numeric matrix embedded as PNG image
+
+    Values are mapped to colors using the matplotlib colormap ``cmap`` between ``vmin`` and ``vmax`` (defaulting to
+    the range of the data). The image covers the cells of the matrix (see :class:`MatrixData`), with the first row at
+    the bottom. Missing values (NaN) are transparent. Requires NumPy and matplotlib.
+    """
+    def __init__(self, data, *args, cmap='viridis', vmin=None, vmax=None, filename=None, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        if not isinstance(data, MatrixData):
+            data = MatrixData(data)
+        image = _np.asarray(data.matrix, dtype=float)
+        x0, x1 = _cell_edges(data.grid_x)
+        y0, y1 = _cell_edges(data.grid_y)
+        if x0 > x1:
+            image = image[:, ::-1]
+            x0, x1 = x1, x0
+        if y0 > y1:
+            image = image[::-1]
+            y0, y1 = y1, y0
+        self.image = image
+        self.cmap = cmap
+        self.vmin = float(_np.nanmin(image)) if vmin is None else vmin
+        self.vmax = float(_np.nanmax(image)) if vmax is None else vmax
+        self['xmin'] = x0
+        self['xmax'] = x1
+        self['ymin'] = y0
+        self['ymax'] = y1
+
+    def write(self, file):
+        from matplotlib.image import imsave
+        if self.filename is None:
+            filename = _ext_filename(file, '.png')
+        else:
+            filename = Path(self.filename)
+            _register_ext_file(file, filename)
+        imsave(filename, self.image, cmap=self.cmap, vmin=self.vmin, vmax=self.vmax, origin='lower')
+        self._write_graphic(file, filename.name if self.filename is None else self.filename)
 
 
 class Fill(TikzElement):
@@ -645,7 +2222,7 @@ class Fill(TikzElement):
 
     def write(self, file):
         file.write('\\addplot+')
-        self.options.write(file)
+        self.write_options(file)
         file.write(' fill between ')
         self.fill_options.write(file)
         file.write(';\n')
@@ -653,57 +2230,84 @@ class Fill(TikzElement):
 
 class ErrorPlot(TikzElement):
     name = 'ErrorPlot'
+    point_counts = None
 
     class _LegendImage(TikzElement):
+        def __init__(self, plot):
+            super().__init__()
+            self.plot = plot
+
+        def _fill_options(self):
+            options = OptionList(self.plot.options)
+            if 'forget plot' in options:
+                del options['forget plot']
+            if 'draw' not in options:
+                options['draw'] = 'none'
+            return options
+
         def write(self, file):
-            if 'forget plot' in self:
-                del (self['forget plot'])
-            if 'draw' not in self.options:
-                self['draw'] = 'none'
             file.write(r'{\fill')
-            self.options.write(file)
+            self._derived('_options', self._fill_options, (self.plot.options,)).write(file)
             file.write('(0cm, -0.1cm) rectangle(0.6cm, 0.1cm);')
             file.write(r'\draw[mark repeat=2,mark phase=2] plot coordinates {(0cm,0cm) (0.3cm,0cm) (0.6cm,0cm)}; }')
 
-    def __init__(self, x, y, e, *args, line_options=None, error_options=None, texlabel=None, legendentry=None, **kwargs):
+    def __init__(self, x, y, e, *args, line_options=None, error_options=None, texlabel=None, legendentry=None,
+                 precision=None, float_format=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.line = CPlot(Coordinates(zip(x, y)), texlabel=texlabel, legendentry=legendentry)
+        x = _as_column(x)
+        y = _as_column(y)
+        if _np is not None:
+            e = _np.asarray(e)
+            upper = y + e[:, 0]
+            lower = y - e[:, 1]
+        else:
+            upper = _as_column(yi + ei[0] for yi, ei in zip(y, e))
+            lower = _as_column(yi - ei[1] for yi, ei in zip(y, e))
+        self.data = TableData({'x': x, 'y': y, 'lower': lower, 'upper': upper}, precision=precision,
+                              float_format=float_format)
+        self.line = CPlot(TableColumns(self.data), texlabel=texlabel, legendentry=legendentry)
         self.line.options.add(*args, **kwargs)
         if line_options is not None:
             self.line.options.add(line_options)
-        ex = _chain(x, reversed(x))
-        ey = _chain((yi + ei[0] for yi, ei in zip(y, e)), (yi-ei[1] for yi, ei in reversed(list(zip(y, e)))))
-        self.error = CPlot(Coordinates(zip(ex, ey)), 'fill', 'forget plot', draw='none', mark='none')
+        path_name = 'errorplot{}'.format(self.data.macro_name[len('tikzplotdata'):])
+        self.upper = self._boundary(TableColumns(self.data, y='upper'), path_name + 'upper', *args, **kwargs)
+        self.lower = self._boundary(TableColumns(self.data, y='lower'), path_name + 'lower', *args, **kwargs)
+        self.error = Fill(path_name + 'upper', path_name + 'lower', 'fill', 'forget plot', draw='none', mark='none')
         self.error['fill opacity'] = 0.1
         self.error.options.add(*args, **kwargs)
         self.error.options.add(error_options)
-        self.children = [self.error, self.line]
+        self.line.inherit = (OptionList({'legend image code/.code': self._LegendImage(self.error)}), self)
+        self.error.inherit = (self,)
+        self.children = [self.data, self.upper, self.lower, self.error, self.line]
+
+    @staticmethod
+    def _boundary(data, path_name, *args, **kwargs):
+        """Invisible plot of the boundary of the error band"""
+        plot = Plot(data, *args, **kwargs)
+        plot.options.add('forget plot', draw='none', mark='none')
+        plot['name path'] = path_name
+        return plot
 
-    def write(self, file):
-        old_line_opts = self.line.options
-        old_error_opts = self.error.options
-        self.line.options = OptionList({'legend image code/.code': self._LegendImage(self.error.options)},
-                                       self.options, old_line_opts)
-        self.error.options = OptionList(self.options, old_error_opts)
-        super().write(file)
-        self.line.options = old_line_opts
-        self.error.options = old_error_opts
-        
 
 class Violin(TikzElement):
     name = 'Violin'
 
-    class _LegendImage(BaseElement):
+    class _LegendImage(TikzElement):
         def __init__(self, violin, orientation):
             super().__init__()
             self.violin = violin
             self.orientation = orientation
 
-        def write(self, file):
-            line_opts = OptionList(self.violin.line.options)
+        def _line_options(self):
+            line_opts = OptionList(self.violin.options, self.violin.line.options)
             if 'forget plot' in line_opts:
                 del line_opts['forget plot']
             line_opts.add('/pgfplots/.cd', {'mark repeat': 2, 'mark phase': 2})
+            return line_opts
+
+        def write(self, file):
+            line_opts = self._derived('_options', self._line_options,
+                                      (self.violin.options, self.violin.line.options))
 
             file.write(r'{\path[/pgfplots/.cd, smooth]')
             if self.orientation == 'vertical':
@@ -720,17 +2324,23 @@ class Violin(TikzElement):
                 file.write(r' plot coordinates {(0cm,0cm) (0.3cm,0cm) (0.6cm,0cm)}; }')
 
     def __init__(self, x, pdf, *args, location=0, orientation='vertical', line_options=None, violin_options=None,
-                 texlabel=None, legendentry=None, **kwargs):
-        y = [location-p for p in pdf] + [location + p for p in pdf[-1::-1]]
+                 texlabel=None, legendentry=None, precision=None, float_format=None, **kwargs):
+        x = _as_column(x)
+        pdf = _as_column(pdf)
+        number_format = {'precision': precision, 'float_format': float_format}
+        if _np is not None:
+            y = _np.concatenate((location - pdf, location + pdf[::-1]))
+        else:
+            y = [location - p for p in pdf] + [location + p for p in pdf[::-1]]
         x_min = min(x)
         x_max = max(x)
         if orientation == 'vertical':
-            self.violin = CPlot(Coordinates(zip(y, x + x[-1::-1])))
-            self.line = Plot(Coordinates([(location, x_min), (location, x_max)]),
+            self.violin = CPlot(Coordinates.from_columns(y, _concat(x, x[::-1]), **number_format))
+            self.line = Plot(Coordinates([(location, x_min), (location, x_max)], **number_format),
                              texlabel=texlabel, legendentry=legendentry)
         elif orientation == 'horizontal':
-            self.violin = CPlot(Coordinates(zip(x + x[-1::-1], y)))
-            self.line = Plot(Coordinates([(x_min, location), (x_max, location)]),
+            self.violin = CPlot(Coordinates.from_columns(_concat(x, x[::-1]), y, **number_format))
+            self.line = Plot(Coordinates([(x_min, location), (x_max, location)], **number_format),
                              texlabel=texlabel, legendentry=legendentry)
         else:
             raise ValueError('Unknown orientation {}'.format(orientation))
@@ -742,31 +2352,462 @@ class Violin(TikzElement):
         self.children.append(self.violin)
         self.children.append(self.line)
         self._legend = self._LegendImage(self, orientation)
-
-    def write(self, file):
-        old_line_opts = self.line.options
-        old_violin_opts = self.violin.options
-        self.line.options = OptionList(self.options, old_line_opts)
-        self.violin.options = OptionList({'legend image code/.code': self._legend}, self.options, old_violin_opts)
-        super().write(file)
-        self.line.options = old_line_opts
-        self.violin.options = old_violin_opts
+        self.line.inherit = (self,)
+        self.violin.inherit = (OptionList({'legend image code/.code': self._legend}), self)
 
 
 class Coordinates(BaseElement):
-    def __init__(self, data, error=None, meta=None):
+    """Coordinate data of a plot stored as columns.
+
+    Pass an iterable of points as ``Coordinates([(x0, y0), (x1, y1), ...], error=None, meta=None)`` or the columns
+    directly as ``Coordinates(x=x, y=y)`` (see :meth:`from_columns`). Columns are stored as NumPy arrays if NumPy is
+    available and as :class:`array.array` (or plain lists for non-numeric data) otherwise.
+
+    Floating point values are written using ``float_format`` (a format spec such as ``'.4f'``) if given, or with
+    ``precision`` significant digits (without trailing zeros and using scientific notation only for large and small
+    exponents). If neither is set, the setting of the figure is used and by default, the shortest representation that
+    round-trips.
+
+    If ``external`` is ``True``, the data is written to a whitespace-separated table file next to the output file
+    and read using ``table {file}``. If ``external`` is ``None``, the ``external_data`` setting of the figure is used.
+
+    If ``stream`` is ``True``, reading the data is deferred until the coordinates are written. The inputs are then
+    consumed in chunks, such that memory use does not depend on the number of points. Streamed coordinates can only be
+    written once (writing them again raises :class:`RuntimeError`). Otherwise, iterators are read into columns.
+    """
+    chunksize = 10000  # number of rows formatted and written at once
+    _stream_written = False
+    _table_keys = {'x': 'x', 'y': 'y', 'z': 'z', 'error': 'y error', 'xerror': 'x error', 'yerror': 'y error',
+                   'meta': 'meta'}
+
+    def __init__(self, data=None, error=None, meta=None, *, x=None, y=None, float_format=None, precision=None,
+                 external=None, stream=False):
         super().__init__()
+        if data is None and (x is None or y is None) or data is not None and (x is not None or y is not None):
+            raise TypeError("Coordinates needs either data or both x and y columns")
+        self.float_format = float_format
+        self.precision = precision
+        self.external = external
+        self._stream = None
+        inputs = (data,) if data is not None else (x, y)
+        if stream:
+            self._stream = zip(*(v for v in inputs + (error, meta) if v is not None))
+            self._stream_layout = (data is not None, error is not None, meta is not None)
+            self.columns = []
+            self.error = None
+            self.meta = None
+            return
+
+        if data is None:
+            columns = [_as_column(x), _as_column(y)]
+        elif _np is not None and isinstance(data, _np.ndarray) and data.ndim == 2:
+            columns = list(data.T)
+        else:
+            columns = [_as_column(c) for c in zip(*data)]
+        if error is not None:
+            error = _as_column(error)
+        if meta is not None:
+            meta = _as_column(meta)
+
+        # truncate to the shortest column (consistent with zip)
+        n = min((len(c) for c in columns + [error, meta] if c is not None), default=0)
+        self.columns = [_truncate(c, n) for c in columns]
+        self.error = None if error is None else _truncate(error, n)
+        self.meta = None if meta is None else _truncate(meta, n)
+
+    @classmethod
+    def from_columns(cls, x, y, error=None, meta=None, **kwargs):
+        """Coordinates from separate ``x`` and ``y`` columns"""
+        return cls(x=x, y=y, error=error, meta=meta, **kwargs)
+
+    @property
+    def x(self):
+        return self.columns[0]
+
+    @property
+    def y(self):
+        return self.columns[1]
+
+    def __len__(self):
+        if self._stream is not None:
+            raise TypeError("number of streamed coordinates is not known before writing")
+        if self.columns:
+            return len(self.columns[0])
+        else:
+            return 0
+
+    def __iter__(self):
+        for block in self._blocks():
+            points = zip(*(_column_values(c) for c in block.columns))
+            error = _repeat(None) if block.error is None else _column_values(block.error)
+            meta = _repeat(None) if block.meta is None else _column_values(block.meta)
+            for p, e, m in zip(points, error, meta):
+                yield Coordinate(p, e, m)
+
+    def _blocks(self, chunksize=None):
+        """Iterate over the data in blocks of Coordinates (reads streamed data in chunks of ``chunksize`` rows)"""
+        if self._stream is None:
+            yield self
+            return
+        if chunksize is None:
+            chunksize = self.chunksize
+        points, has_error, has_meta = self._stream_layout
+        while True:
+            rows = list(_islice(self._stream, chunksize))
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            data = columns.pop(0) if points else None
+            x, y = (None, None) if points else (columns.pop(0), columns.pop(0))
+            error = columns.pop(0) if has_error else None
+            meta = columns.pop(0) if has_meta else None
+            yield Coordinates(data, error, meta, x=x, y=y, float_format=self.float_format, precision=self.precision)
+
+    @property
+    def float_spec(self):
+        return _float_spec(self.float_format, self.precision)
+
+    def _float_spec_for(self, file):
+        """Format spec of this data or else of the figure being written to ``file``"""
+        spec = self.float_spec
+        if spec is None:
+            spec = _float_spec(getattr(file, 'float_format', None), getattr(file, 'precision', None))
+        return spec
+
+    def _error_columns(self):
+        """Return the error data as list of columns (separate x and y error columns if errors are given as pairs)"""
+        error = self.error
         if error is None:
-            error = _repeat(None)
-        if meta is None:
-            meta = _repeat(None)
-        for d, e, m in zip(data, error, meta):
-            self.children.append(Coordinate(d, e, m))
+            return []
+        elif _np is not None and isinstance(error, _np.ndarray) and error.ndim > 1:
+            return [error[:, 0], error[:, 1]]
+        elif not _is_typed_column(error) and any(isinstance(e, tuple) for e in error):
+            return [_as_column(e[0] for e in error), _as_column(e[1] for e in error)]
+        else:
+            return [error]
+
+    @property
+    def table_columns(self):
+        """Names of the columns used when writing the data as a table"""
+        if self._stream is not None:
+            _, has_error, has_meta = self._stream_layout
+            return ['x', 'y'] + ['error'] * has_error + ['meta'] * has_meta
+        names = ['x', 'y', 'z'][:len(self.columns)]
+        names.extend({0: [], 1: ['error'], 2: ['xerror', 'yerror']}[len(self._error_columns())])
+        if self.meta is not None:
+            names.append('meta')
+        return names
+
+    def chunks(self, chunksize=None, table=False, row_end='\n', float_spec=None):
+        """Iterate over the formatted coordinate rows, joined into one string per chunk.
+
+        If ``table`` is ``True``, rows are formatted as whitespace-separated table rows (without header) terminated by
+        ``row_end``. ``float_spec`` overrides the format spec for floating point values.
+        """
+        if chunksize is None:
+            chunksize = self.chunksize
+        if float_spec is None:
+            float_spec = self.float_spec
+        for block in self._blocks(chunksize):
+            yield from block._format_chunks(chunksize, table, row_end, float_spec)
+
+    def _format_chunks(self, chunksize, table, row_end, spec):
+        columns = list(self.columns)
+        if table:
+            columns.extend(self._error_columns())
+            formatters = [_value_formatter(c, spec, _table_formatter(c), missing='0') for c in columns]
+            row = ' '.join('{}' for _ in columns)
+            if self.meta is not None:
+                columns.append(self.meta)
+                formatters.append(_value_formatter(self.meta, spec, _table_formatter(self.meta), ' {}', ' nan'))
+                row += '{}'
+        else:
+            formatters = [_value_formatter(c, spec, repr) for c in columns]
+            row = '(' + ', '.join('{}' for _ in columns) + ')'
+            for column, fmt in ((self.error, ' +- {}'), (self.meta, ' [{}]')):
+                if column is not None:
+                    columns.append(column)
+                    formatters.append(_value_formatter(column, spec, str, fmt))
+                    row += '{}'
+        row = (row + row_end).format
+        # shorten exponents (e.g., 1e-07 -> 1e-7) if the text only contains numbers
+        compact = spec is not None and spec.endswith('g') and all(map(_is_numeric_column, columns))
+        for start in range(0, len(self), chunksize):
+            values = (map(f, _column_values(c[start:start+chunksize])) for f, c in zip(formatters, columns))
+            text = ''.join(map(row, *values))
+            if compact and 'e' in text:
+                text = _exponent_re.sub(_compact_exponent, text)
+            yield text
+
+    def write_table(self, filename, float_spec=None, compress=False, key=None):
+        """Write the data as a whitespace-separated table with header row (text containing whitespace is grouped in
+        braces)
+
+        The table is gzip-compressed if ``compress`` is ``True``. If ``key`` is given, it is stored in a comment line
+        to identify the data.
+        """
+        if compress:
+            f = _gzip_text_writer(filename)
+        else:
+            f = open(filename, 'w', buffering=_buffer_size)
+        with f as f:
+            if key is not None:
+                f.write(_table_header.format(key))
+            f.write(' '.join(self.table_columns) + '\n')
+            for chunk in self.chunks(table=True, float_spec=float_spec):
+                f.write(chunk)
+
+    def _hash_columns(self):
+        return [*self.columns, *self._error_columns(), self.meta]
+
+    def _data_key(self, float_spec):
+        """Hash identifying the table written for this data (``None`` for streamed data)"""
+        if self._stream is not None:
+            return None
+        h = hashlib.sha256()
+        h.update('{} {} {}\n'.format(type(self).__name__, self.table_columns, float_spec).encode())
+        for column in self._hash_columns():
+            if column is None:
+                h.update(b'none;')
+            elif _is_typed_column(column):
+                data = column.tobytes()
+                h.update('{} {}:'.format(getattr(column, 'dtype', getattr(column, 'typecode', '')),
+                                         len(data)).encode())
+                h.update(data)
+            else:
+                data = repr(_column_values(column)).encode()
+                h.update(b'%d:' % len(data))
+                h.update(data)
+        return h.hexdigest()
+
+    def _store_npz(self, filename, float_spec, key):
+        names = self.table_columns
+        columns = list(self.columns) + self._error_columns()
+        if self.meta is not None:
+            columns.append(self.meta)
+        stored = {}
+        for index, (name, column) in enumerate(zip(names, columns)):
+            if not _is_numeric_column(column):
+                # store as formatted text to avoid pickling objects
+                formatter = _value_formatter(column, float_spec, str, missing='nan' if name == 'meta' else '0')
+                column = _np.array(list(map(formatter, _column_values(column))), dtype=str)
+            stored[name] = column
+        _np.savez(filename, key=_np.array(key), names=_np.array(names), spec=_np.array(float_spec or ''), **stored)
+
+    @classmethod
+    def _from_table_columns(cls, columns):
+        """Create coordinates from the columns stored with ``_store_npz``"""
+        data = cls([])
+        data.columns = [columns[name] for name in ('x', 'y', 'z') if name in columns]
+        if 'error' in columns:
+            data.error = columns['error']
+        elif 'xerror' in columns:
+            data.error = _np.column_stack((columns['xerror'], columns['yerror']))
+        data.meta = columns.get('meta')
+        return data
 
     def write(self, file):
+        if self._stream is not None:
+            if self._stream_written:
+                raise RuntimeError("streamed coordinates can only be written once")
+            self._stream_written = True
+        external = self.external if self.external is not None else getattr(file, 'external_data', False)
+        if external:
+            self._write_external(file)
+        else:
+            self._write_inline(file)
+
+    def _write_external(self, file):
+        filename = self._store_external(file)
+        table_options = OptionList()
+        for name in self.table_columns:
+            table_options[self._table_keys[name]] = name
+        file.write("%\n")
+        file.write("table")
+        table_options.write(file)
+        file.write(" {" + filename.name + "};\n")
+
+    def _store_external(self, file):
+        """Store the data in an external file (unless it is up to date) and return the name of the text table"""
+        filename = _ext_filename(file, '.dat', register=False)
+        spec = self._float_spec_for(file)
+        store = getattr(file, 'data_store', 'text')
+        if store == 'npy' and (_np is None or self._stream is not None or type(self) is not Coordinates):
+            store = 'gzip'  # only plain coordinates held in memory are stored as arrays
+        path = filename
+        for other, suffix in _sidecar_suffixes.items():
+            sidecar = filename.with_name(filename.name + suffix)
+            if other == store:
+                path = sidecar
+            elif sidecar.exists():
+                sidecar.unlink()  # remove outdated data
+        _register_ext_file(file, path)
+        key = self._data_key(spec)
+        if key is None or key != _stored_table_key(path):
+            if store == 'npy':
+                self._store_npz(path, spec, key)
+            else:
+                self.write_table(path, spec, compress=store == 'gzip', key=key)
+        return filename
+
+    def _write_inline(self, file):
         file.write("%\n")
         file.write("coordinates {\n")
-        super().write(file)
+        for chunk in self.chunks(float_spec=self._float_spec_for(file)):
+            file.write(chunk)
+        file.write('};\n')
+
+
+class TableData(Coordinates):
+    """Columns of data shared by several plots
+
+    The table is read into the macro ``\\<macro_name>`` (with ``\\pgfplotstableread``) from inline data or an external
+    file (see :class:`Coordinates`). Plots select their columns using :class:`TableColumns`. The macro name is derived
+    from the data, such that it is unique within a document without depending on the order of writing.
+    """
+    def __init__(self, columns, float_format=None, precision=None, external=None):
+        super().__init__([], float_format=float_format, precision=precision, external=external)
+        self.names = list(columns)
+        columns = [_as_column(c) for c in columns.values()]
+        n = min((len(c) for c in columns), default=0)
+        self.columns = [_truncate(c, n) for c in columns]
+
+    @property
+    def table_columns(self):
+        return self.names
+
+    @property
+    def macro_name(self):
+        if 'macro_name' not in self.__dict__:
+            # control sequence names consist of letters only
+            self.__dict__['macro_name'] = 'tikzplotdata' + self._data_key(None)[:16].translate(_digits_to_letters)
+        return self.__dict__['macro_name']
+
+    def write(self, file):
+        external = self.external if self.external is not None else getattr(file, 'external_data', False)
+        file.write("%\n")
+        if external:
+            filename = self._store_external(file)
+            file.write("\\pgfplotstableread{" + filename.name + "}")
+        else:
+            file.write("\\pgfplotstableread[row sep=\\\\]{\n")
+            file.write(' '.join(self.names) + '\\\\\n')
+            for chunk in self.chunks(table=True, row_end='\\\\\n', float_spec=self._float_spec_for(file)):
+                file.write(chunk)
+            file.write("}")
+        file.write("\\" + self.macro_name + "%\n")
+
+
+_digits_to_letters = str.maketrans('0123456789', 'ghijklmnop')
+
+
+class TableColumns(BaseElement):
+    """Plot data given by columns ``x`` and ``y`` of a :class:`TableData` object"""
+    def __init__(self, table, x='x', y='y'):
+        super().__init__()
+        self.table = table
+        self.x = x
+        self.y = y
+
+    def write(self, file):
+        file.write("%\n")
+        file.write("table")
+        OptionList(x=self.x, y=self.y).write(file)
+        file.write(" {\\" + self.table.macro_name + "};\n")
+
+
+class MatrixData(Coordinates):
+    """Data of a matrix plot
+
+    The cells of ``matrix`` are located at ``x`` (columns) and ``y`` (rows). If ``x`` or ``y`` has two elements
+    that do not match the size of the matrix, they are interpreted as range of the grid. The coordinates of the
+    cells are generated in chunks of rows when writing, such that memory use stays close to the size of the matrix.
+    The data is written as inline table (or as external table file, see :class:`Coordinates`).
+
+    If ``max_size`` is given (as maximum number of rows and columns or a single number for both), larger matrices are
+    reduced by averaging blocks of cells (numeric data) or selecting every n-th cell (symbolic data).
+    """
+    def __init__(self, matrix, x=None, y=None, colormodel=None, max_size=None, float_format=None, precision=None,
+                 external=None):
+        super().__init__([], float_format=float_format, precision=precision, external=external)
+        self.colormodel = colormodel
+        if _np is not None:
+            matrix = _np.asarray(matrix)
+            if matrix.ndim != 2:
+                raise ValueError("Expected a 2-d matrix")
+            n_rows, n_cols = matrix.shape
+            self.numeric = matrix.dtype.kind in 'iuf' or (matrix.dtype.kind == 'O' and isinstance(matrix.flat[0], Number))
+        else:
+            matrix = [list(row) for row in matrix]
+            n_rows, n_cols = len(matrix), len(matrix[0])
+            self.numeric = isinstance(matrix[0][0], Number)
+        x = _grid_values(x, n_cols, 'x')
+        y = _grid_values(y, n_rows, 'y')
+        self.original_shape = (n_rows, n_cols)
+
+        if max_size is not None:
+            if _np is None:
+                raise ImportError("reducing the matrix size requires NumPy")
+            if isinstance(max_size, Number):
+                max_size = (max_size, max_size)
+            row_factor = -(-n_rows // max_size[0])
+            col_factor = -(-n_cols // max_size[1])
+            if self.numeric:
+                matrix = _block_mean(_block_mean(matrix, row_factor, axis=0), col_factor, axis=1)
+                x = _block_mean(x, col_factor)
+                y = _block_mean(y, row_factor)
+            else:
+                matrix = matrix[::row_factor, ::col_factor]
+                x = x[::col_factor]
+                y = y[::row_factor]
+
+        self.matrix = matrix
+        self.grid_x = x
+        self.grid_y = y
+
+    @property
+    def shape(self):
+        return len(self.grid_y), len(self.grid_x)
+
+    def __len__(self):
+        n_rows, n_cols = self.shape
+        return n_rows * n_cols
+
+    @property
+    def table_columns(self):
+        return ['x', 'y', 'meta']
+
+    def _hash_columns(self):
+        return [self.matrix, self.grid_x, self.grid_y, None if self.colormodel is None else [self.colormodel]]
+
+    def _blocks(self, chunksize=None):
+        if chunksize is None:
+            chunksize = self.chunksize
+        n_rows, n_cols = self.shape
+        step = max(1, chunksize // n_cols)
+        for start in range(0, n_rows, step):
+            stop = min(start + step, n_rows)
+            if _np is not None:
+                x = _np.tile(self.grid_x, stop - start)
+                y = _np.repeat(self.grid_y[start:stop], n_cols)
+                meta = self.matrix[start:stop].ravel()
+            else:
+                x = _column_values(self.grid_x) * (stop - start)
+                y = [yi for yi in _column_values(self.grid_y[start:stop]) for _ in range(n_cols)]
+                meta = [m for row in self.matrix[start:stop] for m in row]
+            if self.colormodel is not None:
+                meta = ["{}={}".format(self.colormodel, m) for m in _column_values(meta)]
+            yield Coordinates.from_columns(x, y, meta=meta, float_format=self.float_format, precision=self.precision)
+
+    def _write_inline(self, file):
+        table_options = OptionList({'meta': 'meta', 'row sep': r'\\'})
+        file.write("%\n")
+        file.write("table")
+        table_options.write(file)
+        file.write(" {\n")
+        file.write(r'x y meta\\' + '\n')
+        for chunk in self.chunks(table=True, row_end='\\\\\n', float_spec=self._float_spec_for(file)):
+            file.write(chunk)
         file.write('};\n')
 
 
@@ -786,8 +2827,293 @@ class Coordinate(BaseValue):
         file.write("\n")
 
 
+def _as_column(values):
+    """Convert a sequence of values to a contiguous column (NumPy array, array.array or list as fallback)"""
+    if _np is not None:
+        if isinstance(values, _np.ndarray):
+            return values
+        if not isinstance(values, _type.Sequence):
+            values = list(values)
+        column = _np.asarray(values)
+        if column.dtype.kind == 'f' and isinstance(values, list) and any(type(v) is int for v in values):
+            # keep mixed int/float data as is, such that integers are written without decimal point
+            column = _np.asarray(values, dtype=object)
+        return column
+    if isinstance(values, _array):
+        return values
+    values = list(values)
+    if all(type(v) is int for v in values):
+        try:
+            return _array('q', values)
+        except OverflowError:
+            return values
+    elif all(type(v) is float for v in values):
+        return _array('d', values)
+    else:
+        return values
+
+
+def _column_values(column):
+    """Return the values of a column as a list of Python objects"""
+    if isinstance(column, list):
+        return column
+    values = column.tolist()
+    if _np is not None and isinstance(column, _np.ndarray) and column.ndim > 1:
+        values = [tuple(v) for v in values]
+    return values
+
+
+def _is_float_column(column):
+    if _np is not None and isinstance(column, _np.ndarray):
+        return column.dtype.kind == 'f'
+    return isinstance(column, _array) and column.typecode == 'd'
+
+
+def _is_typed_column(column):
+    if _np is not None and isinstance(column, _np.ndarray):
+        return column.dtype.kind != 'O'
+    return isinstance(column, _array)
+
+
+def _is_numeric_column(column):
+    if _np is not None and isinstance(column, _np.ndarray):
+        return column.dtype.kind in 'biuf'
+    return isinstance(column, _array)
+
+
+def _table_formatter(column):
+    """Formatter for table fields of ``column``, grouping text with whitespace in braces"""
+    return str if _is_numeric_column(column) else _table_field
+
+
+def _table_field(value):
+    text = str(value)
+    if not text or _whitespace_re.search(text):
+        return '{' + text + '}'
+    return text
+
+
+_whitespace_re = _re.compile(r'\s')
+
+
+def _float_spec(float_format, precision):
+    if float_format is not None:
+        return float_format
+    elif precision is not None:
+        return '.{}g'.format(precision)
+    else:
+        return None
+
+
+_exponent_re = _re.compile(r'e([+-])0*(?=\d)')
+
+
+def _compact_exponent(match):
+    return 'e-' if match.group(1) == '-' else 'e'
+
+
+def _value_formatter(column, float_spec=None, default=str, template=None, missing=''):
+    """Return a function converting the values of a column to text.
+
+    If a template is given, it is applied to all values except ``None``, which is written as ``missing``.
+    """
+    if float_spec is not None and _is_float_column(column):
+        fmt = ('{:' + float_spec + '}').format
+    elif float_spec is not None and not _is_typed_column(column):
+        float_fmt = ('{:' + float_spec + '}').format
+
+        def fmt(value):
+            return float_fmt(value) if type(value) is float else default(value)
+    else:
+        fmt = default
+
+    if template is None:
+        if missing and not _is_typed_column(column):
+            return lambda value: missing if value is None else fmt(value)
+        return fmt
+    elif _is_typed_column(column):
+        if fmt is str:
+            return template.format
+        template = template.format
+        return lambda value: template(fmt(value))
+    else:
+        return lambda value: missing if value is None else template.format(fmt(value))
+
+
+def _grid_values(values, n, name):
+    """Coordinates of ``n`` grid cells given as values for each cell or as range (two values)"""
+    if values is None:
+        return _as_column(range(n))
+    elif len(values) != n:
+        if len(values) == 2:
+            step = (values[1] - values[0]) / n
+            return _as_column([values[0] + i * step for i in range(n)])
+        else:
+            raise ValueError("Provided {} value does not match matrix size".format(name))
+    return _as_column(values)
+
+
+def _block_mean(values, factor, axis=0):
+    """Average blocks of ``factor`` consecutive entries along ``axis`` (the last block may be smaller)"""
+    if factor <= 1:
+        return values
+    values = _np.moveaxis(_np.asarray(values, dtype=float), axis, 0)
+    padding = [(0, -len(values) % factor)] + [(0, 0)] * (values.ndim - 1)
+    values = _np.pad(values, padding, constant_values=_np.nan)
+    values = _np.nanmean(values.reshape((-1, factor) + values.shape[1:]), axis=1)
+    return _np.moveaxis(values, 0, axis)
+
+
+def _cell_edges(centers):
+    """Outer edges of the grid cells with the given centers"""
+    centers = _column_values(centers)
+    if len(centers) == 1:
+        return centers[0] - 0.5, centers[0] + 0.5
+    return (centers[0] - (centers[1] - centers[0]) / 2,
+            centers[-1] + (centers[-1] - centers[-2]) / 2)
+
+
+def _truncate(column, n):
+    if len(column) > n:
+        return column[:n]
+    else:
+        return column
+
+
+def _concat(a, b):
+    if _np is not None:
+        return _np.concatenate((a, b))
+    else:
+        return _as_column(_chain(a, b))
+
+
+_length_units = {'pt': 1 / 72.27, 'bp': 1 / 72, 'in': 1, 'cm': 1 / 2.54, 'mm': 1 / 25.4, 'pc': 12 / 72.27}
+
+
+def _length_in_inches(length):
+    """Convert a TeX length to inches (returns ``None`` for lengths that cannot be evaluated in python)"""
+    if isinstance(length, Number):
+        return length / 72.27
+    match = _re.fullmatch(r'\s*([0-9.]+)\s*([a-z]{2})\s*', str(length))
+    if match and match.group(2) in _length_units:
+        return float(match.group(1)) * _length_units[match.group(2)]
+    return None
+
+
+def _bucket_bounds(bucket):
+    """Return first and last position of each run of equal values in a sorted array of bucket ids"""
+    starts = _np.flatnonzero(_np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = _np.r_[starts[1:], len(bucket)] - 1
+    return starts, ends
+
+
+def _downsample_index(x, y, n, method='lttb'):
+    """Return sorted indices of the points retained when reducing ``(x, y)`` to about ``n`` points.
+
+    Methods are ``'lttb'`` (largest-triangle-three-buckets), ``'minmax'`` (minimum and maximum of ``y`` in each of
+    ``n // 2`` equal-width buckets of ``x``) and ``'stride'`` (every k-th point). The first and last point are always
+    kept.
+    """
+    x = _np.asarray(x, dtype=float)
+    y = _np.asarray(y, dtype=float)
+    size = len(x)
+    if size <= n or n < 3:
+        return _np.arange(size)
+
+    if method == 'stride':
+        step = -(-size // n)
+        return _np.unique(_np.r_[_np.arange(0, size, step), size - 1])
+
+    elif method == 'minmax':
+        n_buckets = n // 2
+        span = x.max() - x.min()
+        if span > 0:
+            bucket = _np.minimum(((x - x.min()) * (n_buckets / span)).astype(int), n_buckets - 1)
+        else:
+            bucket = _np.zeros(size, dtype=int)
+        order = _np.lexsort((y, bucket))
+        starts, ends = _bucket_bounds(bucket[order])
+        return _np.unique(_np.r_[0, order[starts], order[ends], size - 1])
+
+    elif method == 'lttb':
+        # Buckets of equal size for the interior points. To evaluate all buckets at once, the triangles are formed
+        # with the means of the neighbouring buckets (instead of the point selected in the previous bucket).
+        n_buckets = n - 2
+        edges = 1 + (_np.arange(n_buckets + 1) * (size - 2)) // n_buckets
+        counts = _np.diff(edges)
+        bucket = _np.repeat(_np.arange(n_buckets), counts)
+        xi = x[1:-1]
+        yi = y[1:-1]
+        mean_x = _np.add.reduceat(xi, edges[:-1] - 1) / counts
+        mean_y = _np.add.reduceat(yi, edges[:-1] - 1) / counts
+        ax = _np.r_[x[0], mean_x[:-1]][bucket]
+        ay = _np.r_[y[0], mean_y[:-1]][bucket]
+        cx = _np.r_[mean_x[1:], x[-1]][bucket]
+        cy = _np.r_[mean_y[1:], y[-1]][bucket]
+        area = _np.abs((ax - cx) * (yi - ay) - (ax - xi) * (cy - ay))
+        order = _np.lexsort((-area, bucket))
+        return _np.r_[0, order[edges[:-1] - 1] + 1, size - 1]
+
+    else:
+        raise ValueError("unknown downsampling method {}".format(method))
+
+
+# KernelDensity options that do not change the result of an exact Gaussian kernel density estimate
+_native_kde_options = {'bandwidth', 'kernel', 'algorithm', 'atol', 'rtol', 'breadth_first', 'leaf_size'}
+
+
+def _use_native_kde(kd_params):
+    """Check if a kernel density estimate can be computed without scikit-learn"""
+    return (_np is not None and set(kd_params) <= _native_kde_options
+            and kd_params.get('kernel', 'gaussian') == 'gaussian' and isinstance(kd_params['bandwidth'], Number))
+
+
+def _binned_gaussian_kde(data, xmin, step, size, bandwidth):
+    """Gaussian kernel density estimate evaluated on the grid ``xmin + i*step`` for ``i in range(size)``.
+
+    The data is linearly binned onto the grid (extended by the support of the kernel) and convolved with the kernel
+    using FFT, which takes O(n + size log(size)) operations.
+    """
+    return _binned_gaussian_kdes([data], xmin, step, size, [bandwidth])[0]
+
+
+def _binned_gaussian_kdes(datasets, xmin, step, size, bandwidths):
+    """Evaluate the Gaussian kernel density estimates of several data sets on a shared grid.
+
+    Returns an array with one row per data set (see :func:`_binned_gaussian_kde`).
+    """
+    bandwidths = _np.asarray(bandwidths, dtype=float)
+    lengths = _np.array([len(d) for d in datasets])
+    n_groups = len(datasets)
+    radius = int(min(_np.ceil(5 * bandwidths.max() / step), 4 * size))  # kernel support in grid cells
+    n_bins = size + 2 * radius
+
+    data = _np.concatenate([_np.asarray(d, dtype=float).ravel() for d in datasets])
+    group = _np.repeat(_np.arange(n_groups), lengths)
+    pos = (data - (xmin - radius * step)) / step
+    inside = (pos >= 0) & (pos <= n_bins - 1)
+    pos = pos[inside]
+    left = _np.minimum(pos.astype(int), n_bins - 2)
+    frac = pos - left
+    flat = group[inside] * n_bins + left
+    counts = (_np.bincount(flat, 1 - frac, minlength=n_groups * n_bins)
+              + _np.bincount(flat + 1, frac, minlength=n_groups * n_bins)).reshape(n_groups, n_bins)
+
+    offsets = _np.arange(-radius, radius + 1) * step
+    kernels = _np.exp(-0.5 * (offsets / bandwidths[:, None]) ** 2)
+    n_fft = n_bins + 2 * radius
+    density = _np.fft.irfft(_np.fft.rfft(counts, n_fft) * _np.fft.rfft(kernels, n_fft), n_fft)
+    density = density[:, 2 * radius:2 * radius + size]
+    return _np.maximum(density, 0) / (lengths * bandwidths * _np.sqrt(2 * _np.pi))[:, None]
+
+
+_plain_types = {str, int, float}
+
+
 def as_tikz_value(value):
-    if isinstance(value, Coordinate):
+    if type(value) in _plain_types:
+        return Value(value)
+    elif isinstance(value, Coordinate):
         return EncapsulatedValue(value)
     elif isinstance(value, tuple) and isinstance(value[0], Number):
         return EncapsulatedValue(value)